@@ -0,0 +1,95 @@
+# Copyright (C) 2011 by Sam Edwards <CFSworks@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+"""Measures how many shares per second the checks ShareVerifier.verify
+makes (WorkUnit.matchesResult and hashResults) can get through, one share at
+a time, comparing them against the original per-byte implementation.
+
+Usage: python bench_checkresult.py [shares]
+"""
+
+import os
+import sys
+import time
+import struct
+import hashlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from WorkUnit import WorkUnit, hashResults
+
+class Provider(object):
+    fifo = False
+
+def legacyCheckResult(self, result, target=None):
+    """WorkUnit.checkResult as it was before the bulk byteswap."""
+    if target is None:
+        target = self.target
+    if len(result) != len(self.data):
+        return False
+    if result[:76] != self.data[:76]:
+        return False
+    maskBits = (1<<self.mask)-1
+    resultNonce, = struct.unpack('<I', result[76:80])
+    if (self.getNonce() | maskBits) != (resultNonce | maskBits):
+        return False
+    swappedResult = ''
+    for i in range(80):
+        swappedResult += result[i^3]
+    hash = hashlib.sha256(hashlib.sha256(swappedResult).digest()).digest()
+    for t,h in zip(target[::-1], hash[::-1]):
+        if ord(t) > ord(h):
+            return True
+        elif ord(t) < ord(h):
+            return False
+    return True
+
+def checkResult(unit, result):
+    """The checks ShareVerifier.verify makes, for a single result."""
+    if not unit.matchesResult(result):
+        return False
+    return hashResults([result])[0] <= unit.targetValue
+
+def timeShares(check, unit, results):
+    start = time.time()
+    verdicts = [check(unit, result) for result in results]
+    return len(results) / (time.time() - start), verdicts
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    
+    # Roughly 1 in 256 hashes meet this target, so some shares pass.
+    target = '\xff'*31 + '\x00'
+    unit = WorkUnit(Provider(), os.urandom(80), target)
+    results = [unit.data[:76] + struct.pack('<I', nonce)
+               for nonce in xrange(count)]
+    
+    before, legacy = timeShares(legacyCheckResult, unit, results)
+    after, current = timeShares(checkResult, unit, results)
+    assert legacy == current
+    
+    print 'Verifying %d shares (%d valid):' % (count, sum(current))
+    print '  per-byte swap and compare: %10.0f shares/s' % before
+    print '  bulk swap, integer compare: %9.0f shares/s' % after
+    print '  speedup:                   %10.1fx' % (after/before)
+
+if __name__ == '__main__':
+    main()
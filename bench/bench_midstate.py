@@ -0,0 +1,106 @@
+# Copyright (C) 2011 by Sam Edwards <CFSworks@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+"""Measures how many midstates per second minerutil.Midstate can compute,
+comparing it against the original implementation, both on unique blocks
+and on the repeated blocks that getwork sees when it serves many splits of
+one backend header.
+
+Usage: python bench_midstate.py [midstates]
+"""
+
+import os
+import sys
+import time
+import struct
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from minerutil import Midstate
+from minerutil.Midstate import K, A0, B0, C0, D0, E0, F0, G0, H0
+
+def rotateright(i,p):
+    """i>>>p"""
+    p &= 0x1F # p mod 32
+    return i>>p | ((i<<(32-p)) & 0xFFFFFFFF)
+
+def addu32(*i):
+    return sum(list(i))&0xFFFFFFFF
+
+def legacyCalculateMidstate(data):
+    """calculateMidstate as it was before the rewrite, less state/rounds."""
+    w = list(struct.unpack('<IIIIIIIIIIIIIIII', data))
+    a,b,c,d,e,f,g,h = A0,B0,C0,D0,E0,F0,G0,H0
+    for k in K:
+        s0 = rotateright(a,2) ^ rotateright(a,13) ^ rotateright(a,22)
+        s1 = rotateright(e,6) ^ rotateright(e,11) ^ rotateright(e,25)
+        ma = (a&b) ^ (a&c) ^ (b&c)
+        ch = (e&f) ^ ((~e)&g)
+        
+        h = addu32(h,w[0],k,ch,s1)
+        d = addu32(d,h)
+        h = addu32(h,ma,s0)
+        
+        a,b,c,d,e,f,g,h = h,a,b,c,d,e,f,g
+        
+        s0 = rotateright(w[1],7) ^ rotateright(w[1],18) ^ (w[1] >> 3)
+        s1 = rotateright(w[14],17) ^ rotateright(w[14],19) ^ (w[14] >> 10)
+        w.append(addu32(w[0], s0, w[9], s1))
+        w.pop(0)
+    
+    a = addu32(a, A0)
+    b = addu32(b, B0)
+    c = addu32(c, C0)
+    d = addu32(d, D0)
+    e = addu32(e, E0)
+    f = addu32(f, F0)
+    g = addu32(g, G0)
+    h = addu32(h, H0)
+    
+    return struct.pack('<IIIIIIII', a, b, c, d, e, f, g, h)
+
+def timeMidstates(calculate, blocks):
+    Midstate._cache.clear()
+    start = time.time()
+    midstates = [calculate(block) for block in blocks]
+    return len(blocks) / (time.time() - start), midstates
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    
+    unique = [os.urandom(64) for i in xrange(count)]
+    # Splits of a 2^32 unit into 2^26 pieces: 64 units per header.
+    headers = [os.urandom(64) for i in xrange(max(count // 64, 1))]
+    repeated = [header for header in headers for i in xrange(64)]
+    
+    print 'Computing %d midstates:' % count
+    for name, blocks in [('unique blocks', unique),
+                         ('64 splits per header', repeated)]:
+        before, legacy = timeMidstates(legacyCalculateMidstate, blocks)
+        after, current = timeMidstates(Midstate.calculateMidstate, blocks)
+        assert legacy == current
+        print '  %s:' % name
+        print '    original:  %12.0f midstates/s' % before
+        print '    rewritten: %12.0f midstates/s' % after
+        print '    speedup:   %12.1fx' % (after/before)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+# Copyright (C) 2011 by Sam Edwards <CFSworks@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+"""Measures how many lines per second the MMP server and client protocols can
+parse and dispatch, comparing the precompiled dispatch tables against the
+original getattr-per-line implementation. Command handlers are replaced with
+no-ops, so only parsing and dispatch are measured.
+
+Usage: python bench_mmpdispatch.py [lines]
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from WorkerConnection import WorkerConnection
+from minerutil.MMPProtocol import MMPClientProtocol
+
+class LegacyDispatch(object):
+    """lineReceived/handleCommand as they were before precompiled dispatch."""
+    
+    def lineReceived(self, line):
+        halves = line.split(' :', 1)
+        args = halves[0].split(' ')
+        if len(halves) == 2:
+            args.append(halves[1])
+        cmd = args[0]
+        args = args[1:]
+        self.handleCommand(cmd, args)
+    
+    def handleCommand(self, cmd, args):
+        function = getattr(self, 'cmd_' + cmd, None)
+        if function is None or cmd not in self.commands:
+            return
+        types = self.commands[cmd]
+        optional = len(function.func_defaults or ())
+        if not len(types) - optional <= len(args) <= len(types):
+            converted = False
+        else:
+            converted = True
+            for i,t in enumerate(types[:len(args)]):
+                try:
+                    args[i] = t(args[i])
+                except (ValueError, TypeError):
+                    converted = False
+                    break
+        if converted:
+            function(*args)
+        else:
+            self.illegalCommand(cmd)
+
+class Server(WorkerConnection):
+    def cmd_RESULT(self, hex):
+        pass
+    def cmd_MORE(self, count=1):
+        pass
+
+class Client(MMPClientProtocol):
+    def cmd_WORK(self, work, mask):
+        pass
+    def cmd_ACCEPTED(self, data):
+        pass
+
+class LegacyServer(LegacyDispatch, Server):
+    pass
+
+class LegacyClient(LegacyDispatch, Client):
+    pass
+
+def timeLines(protocol, lines):
+    start = time.time()
+    for line in lines:
+        protocol.lineReceived(line)
+    return len(lines) / (time.time() - start)
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    
+    header = os.urandom(80).encode('hex')
+    serverLines = ['RESULT ' + header, 'RESULT ' + header, 'MORE'] * (count//3)
+    clientLines = ['WORK %s 32' % header, 'ACCEPTED :' + header] * (count//2)
+    
+    for name, legacy, current, lines in [
+        ('server', LegacyServer, Server, serverLines),
+        ('client', LegacyClient, Client, clientLines)]:
+        before = timeLines(legacy(), lines)
+        after = timeLines(current(), lines)
+        print '%s protocol, %d lines:' % (name.capitalize(), len(lines))
+        print '  getattr per line:     %10.0f lines/s' % before
+        print '  precompiled dispatch: %10.0f lines/s (%.1fx)' % (after,
+                                                             after/before)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+# Copyright (C) 2011 by Sam Edwards <CFSworks@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+"""Measures the cost of sorting a large buffer of WorkUnits, comparing the old
+__cmp__ (which read work_fifo from the database on every comparison) against
+the precomputed sort key.
+
+Usage: python bench_worksort.py [units]
+"""
+
+import os
+import sys
+import time
+import random
+import struct
+import sqlite3
+from operator import attrgetter
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from ClusterServer import ClusterServer
+from WorkUnit import WorkUnit
+
+def legacyGetConfig(db, var, type=str, default=None):
+    """ClusterServer.getConfig as it was before config was cached in memory:
+    one SELECT per call.
+    """
+    for value, in db.execute('SELECT value FROM config WHERE var=? '
+                             'LIMIT 1;', (var,)):
+        try:
+            return type(value)
+        except (TypeError, ValueError):
+            return default
+    return default
+
+def legacyCmp(self, other):
+    """WorkUnit.__cmp__ as it was before sort keys were precomputed."""
+    comparison = cmp(other.getTimestamp(), self.getTimestamp())
+    if legacyGetConfig(self.provider.server.db, 'work_fifo', int, 0):
+        comparison = -comparison
+    if comparison != 0:
+        return comparison
+    else:
+        return cmp(self.mask, other.mask)
+
+def makeUnits(provider, count):
+    units = []
+    for i in xrange(count):
+        data = struct.pack('>4s32s32sI8s', '\x00'*4, '\x00'*32, '\x00'*32,
+                           random.randint(0, 600), '\x00'*8)
+        units.append(WorkUnit(provider, data, '\xff'*32,
+                              random.randint(20, 32)))
+    return units
+
+def timeSort(units, **kwargs):
+    work = list(units)
+    start = time.time()
+    work.sort(**kwargs)
+    return time.time() - start, work
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    
+    db = sqlite3.connect(':memory:', isolation_level=None)
+    db.execute('CREATE TABLE config (var VARCHAR UNIQUE, value VARCHAR);')
+    db.execute('INSERT INTO config (var, value) VALUES ("work_fifo", "0");')
+    server = ClusterServer(db)
+    
+    random.seed(0)
+    units = makeUnits(server.workProvider, count)
+    
+    before, legacy = timeSort(units, cmp=legacyCmp)
+    after, current = timeSort(units)
+    keyed, byKey = timeSort(units, key=attrgetter('sortKey'))
+    for work in (current, byKey):
+        assert [(w.getTimestamp(), w.mask) for w in legacy] == \
+               [(w.getTimestamp(), w.mask) for w in work]
+    
+    print 'Sorting %d WorkUnits:' % count
+    print '  SQL lookup per comparison: %8.2f ms' % (before*1000)
+    print '  __cmp__ on sortKey:        %8.2f ms (%.1fx)' % (after*1000,
+                                                         before/after)
+    print '  key=sortKey:               %8.2f ms (%.1fx)' % (keyed*1000,
+                                                         before/keyed)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+# Copyright (C) 2011 by Sam Edwards <CFSworks@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+
+"""Measures the memory taken by 100k live WorkUnits, and the speed of making
+them and of the accessors used when matching and ordering work, comparing
+the __slots__ WorkUnit against the original __dict__-based one.
+
+Units are made the way the WorkPool makes them: a few backend headers, each
+carved into many smaller nonce ranges.
+
+Usage: python bench_workunit.py [units]
+"""
+
+import os
+import sys
+import time
+import struct
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from WorkUnit import WorkUnit, targetToInt
+
+class Provider(object):
+    fifo = False
+
+class LegacyWorkUnit(object):
+    """WorkUnit as it was before __slots__ and decoded fields."""
+    
+    def __init__(self, provider, data, target, mask=32):
+        misc, nonce = struct.unpack('<76sI', data)
+        nonce &= ~((1<<mask)-1)
+        self.data = struct.pack('<76sI', misc, nonce)
+        
+        self.provider = provider
+        self.target = target
+        self.targetValue = targetToInt(target)
+        self.mask = mask
+        self.original = True
+        self.updateSortKey()
+    
+    def isSimilarTo(self, other):
+        return self.data[4:36] == other.data[4:36]
+    
+    def getTimestamp(self):
+        return struct.unpack('>I', self.data[68:72])[0]
+    
+    def getNonce(self):
+        return struct.unpack('<I', self.data[76:80])[0]
+    
+    def updateSortKey(self):
+        timestamp = self.getTimestamp()
+        if not self.provider.fifo:
+            timestamp = -timestamp
+        self.sortKey = (timestamp, self.mask)
+        return self.sortKey
+    
+    def subrange(self, nonce, mask):
+        unit = LegacyWorkUnit.__new__(LegacyWorkUnit)
+        unit.data = self.data[:76] + struct.pack('<I', nonce)
+        unit.provider = self.provider
+        unit.target = self.target
+        unit.targetValue = self.targetValue
+        unit.mask = mask
+        unit.original = self.original and mask == self.mask
+        unit.sortKey = (self.sortKey[0], mask)
+        return unit
+
+def footprint(units):
+    """Bytes used by the units: each object, its __dict__ if it has one, and
+    every distinct object it refers to (other than the shared provider).
+    """
+    seen = set()
+    total = 0
+    for unit in units:
+        objects = [unit]
+        if hasattr(unit, '__dict__'):
+            objects.append(unit.__dict__)
+            values = unit.__dict__.values()
+        else:
+            values = [getattr(unit, name) for name in unit.__slots__]
+        objects.extend(v for v in values if not isinstance(v, Provider))
+        for obj in objects:
+            if id(obj) not in seen:
+                seen.add(id(obj))
+                total += sys.getsizeof(obj)
+    return total
+
+def makeUnits(cls, headers, count):
+    provider = Provider()
+    parents = [cls(provider, header, '\xff'*32) for header in headers]
+    perParent = count // len(parents)
+    mask = 32 - (perParent-1).bit_length()
+    units = []
+    for parent in parents:
+        for i in xrange(perParent):
+            units.append(parent.subrange(i << mask, mask))
+    return units
+
+def timeAccessors(units):
+    start = time.time()
+    first = units[0]
+    for unit in units:
+        unit.getNonce()
+        unit.getTimestamp()
+        unit.isSimilarTo(first)
+    return len(units) / (time.time() - start)
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    headers = [os.urandom(80) for i in xrange(16)]
+    
+    print '%d live WorkUnits:' % count
+    for name, cls in [('__dict__ (original)', LegacyWorkUnit),
+                      ('__slots__', WorkUnit)]:
+        start = time.time()
+        units = makeUnits(cls, headers, count)
+        made = len(units) / (time.time() - start)
+        size = footprint(units)
+        accessed = timeAccessors(units)
+        print '  %s:' % name
+        print '    memory:    %8.1f MB (%d bytes/unit)' % (size/1e6,
+                                                            size//len(units))
+        print '    creation:  %8.0f units/s' % made
+        print '    accessors: %8.0f units/s' % accessed
+        del units
+
+if __name__ == '__main__':
+    main()
@@ -20,11 +20,18 @@
 #
 # If you like it, send 5.00 BTC to 1DKSjFCdUmfivJEL5Gvj41oNspNMsfgy3S :)
 
+import weakref
+from collections import OrderedDict
 from twisted.internet import reactor
 from twisted.internet.protocol import Factory
 from WorkerConnection import WorkerConnection
 from WorkProvider import WorkProvider
 from WebServer import WebServer
+from WorkerAccount import WorkerAccount
+from ConnectionRegistry import ConnectionRegistry
+from ShareVerifier import ShareVerifier
+
+_missing = object() # Memoized in place of values that are absent/unconvertible
 
 class ClusterServer(Factory):
     """ClusterServer is the root class for the server.
@@ -38,13 +45,18 @@ class ClusterServer(Factory):
     
     def __init__(self, db):
         self.db = db
+        self.config = {}
+        self.configTyped = {}
+        self.configCallbacks = {}
+        self.reloadConfig()
+        self.flushAccounts()
         self.workProvider = WorkProvider(self)
-        self.workers = []
+        self.workers = ConnectionRegistry()
+        self.verifier = ShareVerifier(self)
         self.web = None
-        self.configCallbacks = {}
     
     def getConfig(self, var, type=str, default=None, callback=None):
-        """Reads a configuration variable out of the database.
+        """Reads a configuration variable out of the in-memory config.
         
         Will attempt to convert it into the specified type. If the variable
         is not found, or type conversion fails, returns the default.
@@ -55,53 +67,115 @@ class ClusterServer(Factory):
             if callback not in callbacks:
                 callbacks.append(callback)
         
-        # This should only loop once.
-        for value, in self.db.execute('SELECT value FROM config WHERE var=? '
-                                      'LIMIT 1;', (var,)):
-            try:
-                value = type(value)
-            except (TypeError, ValueError):
-                return default
-            else:
-                return value # Type-converted
+        # Conversions are memoized, so each (var, type) is converted once per
+        # change to the variable.
+        converted = self.configTyped.setdefault(var, {})
+        try:
+            value = converted[type]
+        except KeyError:
+            value = converted[type] = self._convertConfig(var, type)
         
-        # Variable is not present in the database.
-        return default
+        if value is _missing:
+            return default
+        return value
+    
+    def _convertConfig(self, var, type):
+        if var not in self.config:
+            return _missing # Variable is not present in the database.
+        try:
+            return type(self.config[var])
+        except (TypeError, ValueError):
+            return _missing
     
     def getAllConfig(self):
-        """Retrieves all configuration values from the database."""
-        config = {}
-        for var, value in self.db.execute('SELECT var, value FROM config;'):
-            config[var] = value
-        return config
+        """Retrieves all configuration values."""
+        return dict(self.config)
 
     def setConfig(self, var, value):
         """Writes a configuration variable to the database.
         
         The value is type-converted to a string for storage.
         """
-        # There might be an old definition, so take it out if so.
-        self.db.execute('DELETE FROM config WHERE var=?;', (var,))
-        if value is not None: # Setting to None means the variable gets cleared.
-            self.db.execute('INSERT INTO config (var,value) VALUES (?,?);',
-                           (var, str(value)))
+        if value is not None:
+            self.db.execute('INSERT OR REPLACE INTO config (var,value) '
+                            'VALUES (?,?);', (var, str(value)))
+            self.config[var] = str(value)
+        else: # Setting to None means the variable gets cleared.
+            self.db.execute('DELETE FROM config WHERE var=?;', (var,))
+            self.config.pop(var, None)
+        self.configTyped.pop(var, None)
 
         # Now inform any waiting callbacks...
+        self._runConfigCallbacks(var)
+    
+    def reloadConfig(self):
+        """Reloads the in-memory config from the database, for when the
+        database has been edited externally. Callbacks are run for every
+        variable that changed.
+        """
+        old = self.config
+        self.config = {}
+        for var, value in self.db.execute('SELECT var, value FROM config;'):
+            self.config[var] = value
+        self.configTyped = {}
+        
+        for var in set(old) | set(self.config):
+            if old.get(var) != self.config.get(var):
+                self._runConfigCallbacks(var)
+    
+    def _runConfigCallbacks(self, var):
         for callback in self.configCallbacks.get(var, []):
             callback()
     
+    def getAccount(self, username):
+        """Gets the WorkerAccount for a username, whether or not the account
+        exists.
+        
+        Recently-used accounts are kept in an LRU cache, sized by the
+        account_cache_size config variable. Accounts still in use elsewhere
+        (e.g. by a connection) are always reused, so there is only ever one
+        WorkerAccount per username.
+        """
+        account = self.accountCache.pop(username, None)
+        if account is None:
+            account = self.accounts.get(username)
+        if account is None:
+            account = WorkerAccount(self, username)
+            self.accounts[username] = account
+        
+        # (Re)inserting moves the account to the most-recently-used end.
+        self.accountCache[username] = account
+        limit = self.getConfig('account_cache_size', int, 1000)
+        while len(self.accountCache) > max(limit, 0):
+            self.accountCache.popitem(last=False)
+        
+        return account
+    
+    def forgetAccount(self, account):
+        """Drops an account from the account cache, e.g. when it is
+        deleted.
+        """
+        if self.accounts.get(account.username) is account:
+            del self.accounts[account.username]
+        if self.accountCache.get(account.username) is account:
+            del self.accountCache[account.username]
+    
+    def flushAccounts(self):
+        """Empties the account cache, so that accounts get reloaded from the
+        database.
+        """
+        self.accounts = weakref.WeakValueDictionary()
+        self.accountCache = OrderedDict()
+    
     def listAccountConnections(self, username):
         """List every connected, logged-in worker using the specified username.
         The username is case-sensitive.
         """
-        return filter(lambda x: x.account and x.account.username == username,
-                      self.workers)
+        return self.workers.listAccount(username)
     
     def getConnection(self, sessionno):
         """Gets a connection by its session ID."""
-        for w in self.workers:
-            if w.transport.sessionno == sessionno:
-                return w
+        return self.workers.get(sessionno)
     
     def start(self):
         """Sets up the server to listen on a port and starts all subsystems."""
@@ -113,3 +187,5 @@ class ClusterServer(Factory):
         self.web.start()
         
         self.workProvider.start()
+        
+        reactor.addSystemEventTrigger('before', 'shutdown', self.verifier.stop)
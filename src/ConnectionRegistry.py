@@ -0,0 +1,80 @@
+# Copyright (C) 2011 by Sam Edwards <CFSworks@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+# If you like it, send 5.00 BTC to 1DKSjFCdUmfivJEL5Gvj41oNspNMsfgy3S :)
+
+from collections import OrderedDict
+
+class ConnectionRegistry(object):
+    """Keeps track of every connected worker, indexed by session number and
+    by account username, so that lookups never have to scan every connection.
+    
+    Iterating over the registry yields connections in the order they
+    connected.
+    """
+    
+    def __init__(self):
+        self.bySession = OrderedDict()
+        self.byUsername = {}
+    
+    def __len__(self):
+        return len(self.bySession)
+    
+    def __iter__(self):
+        # Iterate over a copy, so connections may come and go meanwhile.
+        return iter(self.bySession.values())
+    
+    def add(self, connection):
+        """Register a newly-made connection."""
+        self.bySession[connection.transport.sessionno] = connection
+    
+    def login(self, connection):
+        """Index a connection under its account's username. Call this once
+        the connection has logged in.
+        """
+        username = connection.account.username
+        connections = self.byUsername.setdefault(username, OrderedDict())
+        connections[connection.transport.sessionno] = connection
+    
+    def remove(self, connection):
+        """Unregister a lost connection."""
+        sessionno = connection.transport.sessionno
+        self.bySession.pop(sessionno, None)
+        
+        if connection.account is None:
+            return
+        
+        username = connection.account.username
+        connections = self.byUsername.get(username)
+        if connections is not None:
+            connections.pop(sessionno, None)
+            if not connections:
+                del self.byUsername[username]
+    
+    def get(self, sessionno):
+        """Gets a connection by its session ID, or None."""
+        return self.bySession.get(sessionno)
+    
+    def listAccount(self, username):
+        """List every logged-in connection using the specified username."""
+        connections = self.byUsername.get(username)
+        if connections is None:
+            return []
+        return connections.values()
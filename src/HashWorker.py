@@ -0,0 +1,104 @@
+# Copyright (C) 2011 by Sam Edwards <CFSworks@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+# If you like it, send 5.00 BTC to 1DKSjFCdUmfivJEL5Gvj41oNspNMsfgy3S :)
+
+import os
+import sys
+import struct
+from collections import deque
+from twisted.internet.protocol import ProcessProtocol
+from twisted.python import log
+from twisted.python.failure import Failure
+
+# Run as a script, this file is the hashing process itself; the class below
+# is the reactor's side of the conversation with one.
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                      'HashWorker.py')
+
+class HashWorker(ProcessProtocol):
+    """Hands batches of results to a separate hashing process.
+    
+    Each batch goes down the process's stdin as a 4-byte count followed by
+    the 80-byte results; their digests come back on stdout in the same
+    order. Closing stdin makes the process exit once it has answered
+    everything already sent.
+    """
+    
+    def __init__(self, onHashed, onEnded):
+        self.onHashed = onHashed # Called with each batch and its hashes (or
+                                 # a Failure, if the process dies first)
+        self.onEnded = onEnded # Called with this worker when it exits
+        self.inFlight = deque() # (count, batch) pairs, oldest first
+        self.load = 0 # Results sent and not yet answered
+        self.buffer = ''
+    
+    def hash(self, results, batch):
+        """Sends results off to be hashed. onHashed gets batch, and the
+        hashes as integers, once they're back.
+        """
+        self.inFlight.append((len(results), batch))
+        self.load += len(results)
+        self.transport.write(struct.pack('<I', len(results)) +
+                             ''.join(results))
+    
+    def outReceived(self, data):
+        self.buffer += data
+        while self.inFlight:
+            count, batch = self.inFlight[0]
+            size = 32*count
+            if len(self.buffer) < size:
+                break
+            digests, self.buffer = self.buffer[:size], self.buffer[size:]
+            self.inFlight.popleft()
+            self.load -= count
+            # The hash, like the target, is a little-endian number.
+            self.onHashed(batch, [int(digests[i:i+32][::-1].encode('hex'), 16)
+                                  for i in xrange(0, size, 32)])
+    
+    def errReceived(self, data):
+        log.msg('Hashing process: ' + data.rstrip())
+    
+    def processEnded(self, reason):
+        inFlight, self.inFlight = self.inFlight, deque()
+        self.load = 0
+        for count, batch in inFlight:
+            self.onHashed(batch, Failure(RuntimeError(
+                'hashing process exited: %s' % reason.getErrorMessage())))
+        self.onEnded(self)
+
+def main():
+    from WorkUnit import digestResults
+    
+    stdin, stdout = sys.stdin, sys.stdout
+    while True:
+        header = stdin.read(4)
+        if len(header) < 4:
+            break
+        count, = struct.unpack('<I', header)
+        data = stdin.read(80*count)
+        if len(data) < 80*count:
+            break
+        stdout.write(''.join(digestResults([data[i:i+80]
+                                            for i in xrange(0, len(data), 80)])))
+        stdout.flush()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+# Copyright (C) 2011 by Sam Edwards <CFSworks@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+# If you like it, send 5.00 BTC to 1DKSjFCdUmfivJEL5Gvj41oNspNMsfgy3S :)
+
+class NonceAllocator(object):
+    """Divides up the nonce range of one backend WorkUnit, buddy-style.
+    
+    Because pieces are always carved out of the smallest free range that is
+    big enough, there is never more than one free range per mask, much like
+    the bits of a binary number. Handing out a piece is integer arithmetic:
+    a free range is halved until it is the size wanted, and the unused upper
+    halves stay free. Only the pieces actually handed out become WorkUnits.
+    """
+    
+    def __init__(self, unit):
+        self.unit = unit
+        self.free = {unit.mask: unit.getNonce()} # Maps mask -> base nonce
+        self.updateSortKey()
+    
+    def updateSortKey(self):
+        """Recompute (and return) the age part of the unit's sort key, which
+        orders this allocator against the others in the WorkPool.
+        """
+        self.sortKey = self.unit.updateSortKey()[0]
+        return self.sortKey
+    
+    def take(self, freeMask, mask):
+        """Returns a WorkUnit of 2^mask nonces, split off the free range of
+        2^freeMask nonces. This leaves one new free range at each mask from
+        mask up to (but not including) freeMask.
+        """
+        nonce = self.free.pop(freeMask)
+        for m in xrange(mask, freeMask):
+            self.free[m] = nonce | (1<<m)
+        return self.unit.subrange(nonce, mask)
@@ -0,0 +1,73 @@
+# Copyright (C) 2011 by Sam Edwards <CFSworks@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+# If you like it, send 5.00 BTC to 1DKSjFCdUmfivJEL5Gvj41oNspNMsfgy3S :)
+
+import time
+
+class RateMeter(object):
+    """Estimates how quickly something is happening, in units per second.
+    
+    Amounts are accumulated over windows of a fixed length; at the end of each
+    window, the observed rate is folded into an exponentially-weighted moving
+    average.
+    
+    With a window of None, nothing is accumulated; each sample passed to fold
+    goes straight into the average. This is used for averaging latencies.
+    """
+    
+    def __init__(self, window=10.0, weight=0.3):
+        self.window = window
+        self.weight = weight
+        self.rate = None # No estimate until the first window closes.
+        self.count = 0
+        self.start = time.time()
+    
+    def add(self, amount=1):
+        """Record that amount units have happened just now."""
+        self._sample()
+        self.count += amount
+    
+    def getRate(self, default=None):
+        """Returns the current estimate, or default if there is none yet."""
+        self._sample()
+        if self.rate is None:
+            return default
+        return self.rate
+    
+    def fold(self, sample):
+        """Fold one observation directly into the moving average."""
+        if self.rate is None:
+            self.rate = sample
+        else:
+            self.rate += self.weight * (sample - self.rate)
+    
+    def _sample(self):
+        if self.window is None:
+            return
+        
+        now = time.time()
+        elapsed = now - self.start
+        if elapsed < self.window:
+            return
+        
+        self.fold(self.count / elapsed)
+        self.count = 0
+        self.start = now
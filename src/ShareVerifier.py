@@ -0,0 +1,216 @@
+# Copyright (C) 2011 by Sam Edwards <CFSworks@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+# If you like it, send 5.00 BTC to 1DKSjFCdUmfivJEL5Gvj41oNspNMsfgy3S :)
+
+import os
+import sys
+import time
+from collections import deque
+from twisted.internet import reactor, defer
+from twisted.python import log
+from twisted.python.failure import Failure
+from WorkUnit import hashResults, targetToInt
+from RateMeter import RateMeter
+from HashWorker import HashWorker, SCRIPT
+
+class ShareVerifier(object):
+    """Hashes the results that workers turn in.
+    
+    Results are queued up and hashed together at the end of the current
+    reactor iteration, so that a burst of shares (from many connections, or
+    one pipelining client) is handled as one batch rather than one at a time.
+    The verify_batch config variable caps the size of a batch; setting it to
+    1 hashes every result as soon as it arrives.
+    
+    Batches are hashed inline by default. If verify_processes is set, batches
+    of more than verify_inline results go to that many hashing processes
+    instead (see HashWorker), up to verify_queue results at a time; past
+    that, batches are hashed inline again. Threads wouldn't do: hashlib
+    keeps the GIL for inputs as short as a block header.
+    """
+    
+    def __init__(self, server):
+        self.server = server
+        self.queue = [] # (result, Deferred) pairs
+        self.queuedAt = None # When the oldest result in the queue arrived
+        self.flushCall = None
+        
+        self.pending = deque() # Batches awaiting verdicts, oldest first
+        self.offloaded = 0 # Results currently in hashing processes
+        self.latency = RateMeter(None) # Arrival to verdict, in seconds
+        self.batchCounts = {'inline': 0, 'offloaded': 0}
+        
+        self.workers = [] # HashWorkers taking new batches
+        self.running = set() # Every HashWorker whose process hasn't exited
+        self.stopped = False
+        self.stopWaiters = [] # Deferreds from stop, waiting on self.running
+    
+    def hashResult(self, result):
+        """Returns a Deferred that fires with the hash of the 80-byte result,
+        as an integer to compare against a target value.
+        """
+        batch = self.server.getConfig('verify_batch', int, 256)
+        if batch <= 1:
+            return defer.succeed(hashResults([result])[0])
+        
+        d = defer.Deferred()
+        if not self.queue:
+            self.queuedAt = time.time()
+        self.queue.append((result, d))
+        if len(self.queue) >= batch:
+            self.flush()
+        elif self.flushCall is None:
+            self.flushCall = reactor.callLater(0, self.flush)
+        return d
+    
+    def verify(self, unit, result, target=None):
+        """Returns a Deferred that fires with True if the result belongs to
+        the WorkUnit and meets target (a share target, or else the WorkUnit's
+        own). This is how both workers and getwork miners turn results in.
+        
+        Accepted results count towards the WorkProvider's hashrate estimate,
+        and those that meet the WorkUnit's own target are passed on to it as
+        solutions. A result that can't be hashed is logged and rejected.
+        """
+        if not unit.matchesResult(result):
+            return defer.succeed(False)
+        if target is None:
+            target = unit.target
+        d = self.hashResult(result)
+        d.addCallback(self._checkHash, unit, result, target)
+        d.addErrback(self._verifyFailed)
+        return d
+    
+    def _checkHash(self, hash, unit, result, target):
+        if hash > targetToInt(target):
+            return False
+        
+        self.server.workProvider.recordShare(target)
+        if hash <= unit.targetValue:
+            self.server.workProvider.sendResult(result)
+        return True
+    
+    def _verifyFailed(self, failure):
+        log.err(failure, 'Checking a result failed')
+        return False
+    
+    def flush(self):
+        """Starts hashing everything in the queue."""
+        if self.flushCall is not None and self.flushCall.active():
+            self.flushCall.cancel()
+        self.flushCall = None
+        
+        queue, self.queue = self.queue, []
+        if not queue:
+            return
+        results = [result for result, d in queue]
+        
+        inline = self.server.getConfig('verify_inline', int, 16)
+        limit = self.server.getConfig('verify_queue', int, 4096)
+        # Verdicts go out in the order results came in, so a batch finished
+        # early waits for any offloaded ones ahead of it.
+        batch = [queue, self.queuedAt, None]
+        self.pending.append(batch)
+        worker = None
+        if len(queue) > inline and self.offloaded + len(queue) <= limit:
+            worker = self.getWorker()
+        
+        if worker is None:
+            self.batchCounts['inline'] += 1
+            batch[2] = hashResults(results)
+            self._deliver()
+        else:
+            self.batchCounts['offloaded'] += 1
+            self.offloaded += len(queue)
+            worker.hash(results, batch)
+    
+    def getWorker(self):
+        """Returns the least busy of verify_processes hashing processes,
+        starting or stopping some if the setting has changed, or None if
+        results are to be hashed inline.
+        """
+        size = self.server.getConfig('verify_processes', int, 0)
+        if self.stopped:
+            size = 0
+        while len(self.workers) > max(size, 0):
+            # It finishes what it has before it exits.
+            self.workers.pop().transport.closeStdin()
+        while len(self.workers) < size:
+            worker = HashWorker(self._offloadDone, self._workerEnded)
+            reactor.spawnProcess(worker, sys.executable,
+                                 [sys.executable, SCRIPT], env=os.environ)
+            self.workers.append(worker)
+            self.running.add(worker)
+        
+        if not self.workers:
+            return None
+        return min(self.workers, key=lambda worker: worker.load)
+    
+    def stop(self):
+        """Stops the hashing processes once they've answered everything
+        already sent to them; later batches are hashed inline. Returns a
+        Deferred that fires when the processes have all exited.
+        """
+        self.stopped = True
+        self.getWorker()
+        
+        d = defer.Deferred()
+        if self.running:
+            self.stopWaiters.append(d)
+        else:
+            d.callback(None)
+        return d
+    
+    def _workerEnded(self, worker):
+        if worker in self.workers:
+            self.workers.remove(worker) # It died; it'll be replaced.
+        self.running.discard(worker)
+        if not self.running:
+            waiters, self.stopWaiters = self.stopWaiters, []
+            for d in waiters:
+                d.callback(None)
+    
+    def _offloadDone(self, batch, hashes):
+        self.offloaded -= len(batch[0])
+        batch[2] = hashes
+        self._deliver()
+    
+    def _deliver(self):
+        while self.pending and self.pending[0][2] is not None:
+            queue, queuedAt, hashes = self.pending.popleft()
+            
+            self.latency.fold(time.time() - queuedAt)
+            
+            if isinstance(hashes, Failure):
+                for result, d in queue:
+                    d.errback(hashes)
+            else:
+                for (result, d), hash in zip(queue, hashes):
+                    d.callback(hash)
+    
+    def getStats(self):
+        """Returns a dict describing the verification backlog."""
+        return {
+                "queued": len(self.queue),
+                "offloaded": self.offloaded,
+                "latency": self.latency.getRate(),
+                "batches": dict(self.batchCounts)
+               }
@@ -1,14 +1,19 @@
 import json
 from twisted.internet import reactor, defer
+from twisted.python import log
 from twisted.web import server, script
 from twisted.web.resource import Resource
 from twisted.web.static import File
-from WorkerAccount import WorkerAccount
 from minerutil.Midstate import calculateMidstate
+from WorkHistory import WorkHistory
 
-def rpcError(code, msg):
-    return '{"result": null, "error": {"code": %d, "message": "%s"}, ' \
-           '"id": null}' % (code, msg)
+LONG_POLL_PATH = '/LP'
+
+# Methods that non-admins may call.
+GETWORK_METHODS = ('getwork', 'getworks')
+
+def rpcError(code, msg, id=None):
+    return {'result': None, 'error': {'code': code, 'message': msg}, 'id': id}
 
 class WebServer(Resource):
     """This provides the web/RPC interface to the server.
@@ -20,12 +25,16 @@ class WebServer(Resource):
         Resource.__init__(self)
         self.server = server
         
-        # This maps account IDs to assigned WorkUnits.
+        # This maps account IDs to a WorkHistory of assigned WorkUnits.
         self.assignedWork = {}
     
-        # This has the same purpose as in WorkProvider.
+        # This has the same purpose as in WorkProvider: when work stops being
+        # similar to it, every account's assigned work is purged.
         self.template = None
         
+        # This maps parked long-poll requests to (account, lost) tuples.
+        self.longPolls = {}
+        
         rootdir = self.server.getConfig('web_root', str, 'www')
         self.root = File(rootdir)
         self.root.processors = {'.rpy': script.ResourceScript}
@@ -41,50 +50,177 @@ class WebServer(Resource):
     def getChild(self, name, request):
         versionString = 'multiminer/%d.%d' % self.server.versionNumber
         request.setHeader('Server', versionString)
-        if request.method == 'GET' or request.path != '/':
+        if request.path == LONG_POLL_PATH:
+            return LongPollResource(self)
+        elif request.method == 'GET' or request.path != '/':
             return self.root
         else:
             return self
     
-    def render_POST(self, request):
+    def authenticate(self, request):
+        """Checks the HTTP credentials on a request, returning the account if
+        they are valid. Otherwise, the response code is set to 401, and None
+        is returned.
+        """
         request.setHeader('WWW-Authenticate', 'Basic realm="Multiminer RPC"')
         request.setHeader('Content-Type', 'application/json')
-        account = WorkerAccount(self.server, request.getUser())
+        account = self.server.getAccount(request.getUser())
         if not account.exists():
             loggedIn = False
         else:
             loggedIn = account.checkPassword(request.getPassword())
         if not loggedIn:
             request.setResponseCode(401)
-            return rpcError(-1, 'Username/password invalid.')
+            return None
+        return account
+    
+    def render_POST(self, request):
+        account = self.authenticate(request)
+        if account is None:
+            return json.dumps(rpcError(-1, 'Username/password invalid.'))
+        request.setHeader('X-Long-Polling', LONG_POLL_PATH)
         
         try:
             data = json.loads(request.content.read())
+        except ValueError:
+            return json.dumps(rpcError(-32700, 'Parse error.'))
+        
+        # An array is a batch of calls, which are all answered in one response.
+        if isinstance(data, list):
+            if not data:
+                return json.dumps(rpcError(-32600, 'Invalid request.'))
+            if not self.checkBatch(account, data):
+                return json.dumps(rpcError(-32600, 'Batch too large.'))
+            d = defer.gatherResults([self.call(account, x) for x in data])
+        else:
+            d = self.call(account, data)
+        
+        def callback(response):
+            request.write(json.dumps(response))
+            request.finish()
+        d.addCallback(callback)
+        
+        return server.NOT_DONE_YET
+    
+    def checkBatch(self, account, batch):
+        """Returns False if a batch has more than rpc_batch_max calls, or asks
+        for more than getwork_max_units units of work all told.
+        """
+        if len(batch) > account.getConfig('rpc_batch_max', int, 32):
+            return False
+        
+        units = 0
+        for data in batch:
+            try:
+                method = data['method']
+                params = data['params']
+            except (KeyError, TypeError):
+                continue
+            if method == 'getwork' and not params:
+                units += 1
+            elif method == 'getworks':
+                try:
+                    units += max(int(params[0]), 1)
+                except (ValueError, TypeError, IndexError, KeyError):
+                    pass
+        return units <= account.getConfig('getwork_max_units', int, 16)
+    
+    def call(self, account, data):
+        """Runs a single JSON-RPC call, returning a Deferred that fires with
+        the response object.
+        """
+        try:
             id = data['id']
             method = str(data['method'])
             params = list(data['params'])
-        except ValueError:
-            return rpcError(-32700, 'Parse error.')
-        except (KeyError, TypeError):
-            return rpcError(-32600, 'Invalid request.')
+        except (KeyError, TypeError, ValueError):
+            return defer.succeed(rpcError(-32600, 'Invalid request.'))
         
-        if method != 'getwork':
+        if method not in GETWORK_METHODS:
             if not account.getData('admin', int, 0):
-                return rpcError(-2, 'Non-admins restricted to getwork only.')
+                return defer.succeed(rpcError(-2, 'Non-admins restricted to '
+                                                  'getwork only.', id))
         
         func = getattr(self, 'rpc_' + method, None)
         if func is None:
-            return rpcError(-32601, 'Method not found.')
+            return defer.succeed(rpcError(-32601, 'Method not found.', id))
         
         d = defer.maybeDeferred(func, account, params)
+        d.addCallback(lambda result: {'result': result, 'error': None,
+                                      'id': id})
+        d.addErrback(self._callFailed, id)
+        return d
+    
+    def _callFailed(self, failure, id):
+        log.err(failure, 'JSON-RPC call failed')
+        return rpcError(-32603, 'Internal error.', id)
+    
+    def parkLongPoll(self, request, account):
+        """Holds a long-poll request open until there is new work."""
+        lost = [] # Gets an entry if the miner hangs up.
+        self.longPolls[request] = (account, lost)
+        def errback(failure):
+            lost.append(failure)
+            self.longPolls.pop(request, None)
+        request.notifyFinish().addErrback(errback)
+    
+    def sendLongPolls(self):
+        """Answers every parked long-poll request with fresh work. This is
+        called by the WorkProvider as soon as work for a new block arrives.
+        """
+        polls, self.longPolls = self.longPolls, {}
+        for request, (account, lost) in polls.iteritems():
+            d = self.getWork(account)
+            def callback(result, request=request, lost=lost):
+                # The miner may have hung up while waiting for work.
+                if lost:
+                    return
+                request.write(json.dumps({'result': result, 'error': None,
+                                          'id': None}))
+                request.finish()
+            d.addCallback(callback)
+    
+    def assignWork(self, account):
+        """Gets a unit for an account and adds it to the account's work
+        history, returning a Deferred that fires with the unit.
+        """
+        desiredMask = account.getConfig('work_mask', int, 32)
+        d = self.server.workProvider.getWork(desiredMask)
         
-        def callback(result):
-            jsonResult = json.dumps({'result': result, 'error': None, 'id': id})
-            request.write(jsonResult)
-            request.finish()
+        def callback(wu):
+            if self.template is None or not self.template.isSimilarTo(wu):
+                self.template = wu
+                self.assignedWork = {}
+            
+            work = self.assignedWork.get(account.id)
+            if work is None:
+                work = self.assignedWork[account.id] = WorkHistory()
+            work.limit = account.getConfig('work_history', int, 256)
+            work.maxAge = account.getConfig('work_expiry', int, 0)
+            work.add(wu)
+            return wu
         d.addCallback(callback)
         
-        return server.NOT_DONE_YET
+        return d
+    
+    def formatWork(self, wu):
+        """Represents a unit as a getwork response."""
+        padding = '00000080' + '00000000'*10 + '80020000'
+        hash1 = '00000000'*8 + '00000080' + '00000000'*6 + '00010000'
+        
+        return {
+                "midstate": calculateMidstate(wu.prefix[:64]).encode('hex'),
+                "data": wu.data.encode('hex') + padding,
+                "hash1": hash1,
+                "target": wu.target.encode('hex'),
+                "mask": wu.mask
+               }
+    
+    def getWork(self, account):
+        """Gets work for an account, returning a Deferred that fires with the
+        getwork response.
+        """
+        return self.assignWork(account).addCallback(self.formatWork)
     
     def dumpConnection(self, connection):
         """Represent a connection as a dict so that it may be converted to a
@@ -116,33 +252,35 @@ class WebServer(Resource):
                result = hex.decode('hex')[:80]
             except TypeError:
                 return False
-            work = self.assignedWork.get(account.id, list())
-            for wu in work:
-                if wu.checkResult(result):
-                    self.server.workProvider.sendResult(result)
-                    return True
-            return False
-        
-        desiredMask = account.getConfig('work_mask', int, 32)
-        d = self.server.workProvider.getWork(desiredMask)
+            work = self.assignedWork.get(account.id)
+            if work is None:
+                return False
+            wu, target = work.claim(result)
+            if wu is None:
+                return False
+            return self.server.verifier.verify(wu, result)
         
-        def callback(wu):
-            work = self.assignedWork.setdefault(account.id, list())
-            work.append(wu)
-            
-            padding = '00000080' + '00000000'*10 + '80020000'
-            hash1 = '00000000'*8 + '00000080' + '00000000'*6 + '00010000'
-            
-            return {
-                    "midstate": calculateMidstate(wu.data[:64]).encode('hex'),
-                    "data": wu.data.encode('hex') + padding,
-                    "hash1": hash1,
-                    "target": wu.target.encode('hex'),
-                    "mask": wu.mask
-                   }
-        d.addCallback(callback)
+        return self.getWork(account)
+    
+    def rpc_getworks(self, account, params):
+        """Extension of getwork: returns a list of several units at once, to
+        save on requests. The count is capped at getwork_max_units.
+        """
+        try:
+            count = int(params[0])
+        except (ValueError, TypeError, IndexError):
+            return None
         
-        return d
+        count = min(count, account.getConfig('getwork_max_units', int, 16))
+        # Units split off the same header share their first 64 bytes, so
+        # after the first, the midstates come out of Midstate's cache.
+        return defer.gatherResults([self.getWork(account)
+                                    for i in range(max(count, 1))])
+    
+    def rpc_getworkstats(self, account, params):
+        stats = self.server.workProvider.getStats()
+        stats['verifier'] = self.server.verifier.getStats()
+        return stats
     
     def rpc_getconfig(self, account, params):
         return self.server.getAllConfig()
@@ -154,13 +292,18 @@ class WebServer(Resource):
         else:
             return False
     
+    def rpc_reloadconfig(self, account, params):
+        self.server.reloadConfig()
+        self.server.flushAccounts()
+        return True
+    
     def rpc_getworker(self, account, params):
         if len(params) == 1:
             username = str(params[0])
         else:
             return None
         
-        worker = WorkerAccount(self.server, username)
+        worker = self.server.getAccount(username)
         if not worker.exists():
             return None
         
@@ -182,7 +325,7 @@ class WebServer(Resource):
         else:
             return False
         
-        worker = WorkerAccount(self.server, username)
+        worker = self.server.getAccount(username)
         if not worker.exists():
             return False
         
@@ -211,7 +354,7 @@ class WebServer(Resource):
         else:
             return False
         
-        worker = WorkerAccount(self.server, username)
+        worker = self.server.getAccount(username)
         if not worker.exists():
             id = worker.create()
             worker.setData('password', password)
@@ -223,7 +366,7 @@ class WebServer(Resource):
         else:
             return False
         
-        worker = WorkerAccount(self.server, username)
+        worker = self.server.getAccount(username)
         if not worker.exists():
             return False
         
@@ -258,4 +401,24 @@ class WebServer(Resource):
             connection.kick()
             return True
         
-        return False
\ No newline at end of file
+        return False
+
+class LongPollResource(Resource):
+    """Parks long-poll requests from getwork miners with the WebServer."""
+    
+    isLeaf = True
+    
+    def __init__(self, web):
+        Resource.__init__(self)
+        self.web = web
+    
+    def render_GET(self, request):
+        account = self.web.authenticate(request)
+        if account is None:
+            return json.dumps(rpcError(-1, 'Username/password invalid.'))
+        
+        self.web.parkLongPoll(request, account)
+        return server.NOT_DONE_YET
+    
+    # Some miners POST their long-poll requests.
+    render_POST = render_GET
@@ -0,0 +1,137 @@
+# Copyright (C) 2011 by Sam Edwards <CFSworks@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+# If you like it, send 5.00 BTC to 1DKSjFCdUmfivJEL5Gvj41oNspNMsfgy3S :)
+
+import time
+import struct
+from collections import OrderedDict
+
+class WorkHistory(object):
+    """Remembers the WorkUnits handed out to a worker, so that a result can be
+    matched to the unit it came from without trying every unit.
+    
+    Units are indexed by their 76-byte header prefix plus nonce range. Only
+    units similar to the most recent one (i.e. on the same block) are kept,
+    only the newest limit of those, and (if maxAge is set) only those handed
+    out within the last maxAge seconds, so memory stays flat no matter how
+    long the worker stays around.
+    """
+    
+    def __init__(self, limit=None, maxAge=None):
+        self.limit = limit
+        self.maxAge = maxAge
+        self.clear()
+    
+    def __len__(self):
+        return len(self.units)
+    
+    def clear(self):
+        """Forget all units."""
+        # Maps (prefix, nonce, mask) -> (WorkUnit, share target, time added,
+        # set of nonces claimed), oldest first
+        self.units = OrderedDict()
+        self.masks = {} # Maps mask -> number of units having it
+    
+    def add(self, unit, shareTarget=None):
+        """Remember a WorkUnit, along with the target that the worker was told
+        to submit results for (if not the unit's own target). Units from a
+        previous block, and the oldest units beyond the limit, are forgotten.
+        """
+        if self.units:
+            newest = self.units[next(reversed(self.units))][0]
+            if not newest.isSimilarTo(unit):
+                self.clear()
+        
+        key = (unit.prefix, unit.nonce, unit.mask)
+        claimed = set()
+        if key in self.units:
+            # So that it moves to the newest end, remembering what was
+            # already turned in.
+            claimed = self.units.pop(key)[3]
+        else:
+            self.masks[unit.mask] = self.masks.get(unit.mask, 0) + 1
+        self.units[key] = (unit, shareTarget or unit.target, time.time(),
+                           claimed)
+        
+        while self.limit is not None and len(self.units) > max(self.limit, 1):
+            self._forgetOldest()
+        self._expire()
+    
+    def _expire(self):
+        if not self.maxAge:
+            return
+        
+        cutoff = time.time() - self.maxAge
+        while self.units:
+            added = next(self.units.itervalues())[2]
+            if added >= cutoff:
+                break
+            self._forgetOldest()
+    
+    def _forgetOldest(self):
+        key, entry = self.units.popitem(last=False)
+        self._forgetMask(entry[0].mask)
+    
+    def _forgetMask(self, mask):
+        self.masks[mask] -= 1
+        if not self.masks[mask]:
+            del self.masks[mask]
+    
+    def find(self, result):
+        """Returns the WorkUnit that an 80-byte result belongs to, along with
+        its share target, or (None, None).
+        
+        This only finds the unit; the result still has to be checked against
+        it with ShareVerifier.verify.
+        """
+        entry = self._findEntry(result)
+        if entry is None:
+            return None, None
+        return entry[0], entry[1]
+    
+    def claim(self, result):
+        """Like find, but each result can only be claimed once; turning the
+        same result in again gets (None, None). This keeps a worker from
+        having one share counted over and over.
+        """
+        entry = self._findEntry(result)
+        if entry is None or result[76:80] in entry[3]:
+            return None, None
+        entry[3].add(result[76:80])
+        return entry[0], entry[1]
+    
+    def _findEntry(self, result):
+        if len(result) != 80:
+            return None
+        
+        self._expire()
+        
+        prefix = result[:76]
+        nonce, = struct.unpack('<I', result[76:80])
+        
+        # Workers almost always get units of a single size, so this seldom
+        # needs more than one lookup.
+        for mask in self.masks:
+            base = nonce & ~((1<<mask)-1)
+            entry = self.units.get((prefix, base, mask))
+            if entry is not None:
+                return entry
+        return None
@@ -0,0 +1,108 @@
+# Copyright (C) 2011 by Sam Edwards <CFSworks@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+# If you like it, send 5.00 BTC to 1DKSjFCdUmfivJEL5Gvj41oNspNMsfgy3S :)
+
+import heapq
+import itertools
+from NonceAllocator import NonceAllocator
+
+class WorkPool(object):
+    """A buffer of work, kept by the WorkProvider.
+    
+    Each backend WorkUnit added to the pool gets a NonceAllocator, and the
+    pool indexes the allocators' free ranges by mask. Each mask's bucket is a
+    heap ordered by age (newest first, unless the work_fifo config variable
+    is set). This lets the provider take work of any size without sorting
+    the buffer, or creating WorkUnits that nobody has asked for yet.
+    """
+    
+    def __init__(self):
+        self.clear()
+    
+    def __len__(self):
+        return self.count
+    
+    def clear(self):
+        """Empty out the pool."""
+        self.buckets = {} # Maps mask -> heap of ((age, mask), seq, allocator)
+        self.count = 0 # Number of free ranges.
+        self.hashes = 0L # Number of possible unique hashes.
+        self.sequence = itertools.count()
+    
+    def rekey(self):
+        """Reorder the pool after the provider's work_fifo policy changes."""
+        for mask, bucket in self.buckets.items():
+            bucket[:] = [((allocator.updateSortKey(), mask), seq, allocator)
+                         for key, seq, allocator in bucket]
+            heapq.heapify(bucket)
+    
+    def _index(self, allocator, mask):
+        bucket = self.buckets.setdefault(mask, [])
+        heapq.heappush(bucket, ((allocator.sortKey, mask),
+                                next(self.sequence), allocator))
+    
+    def add(self, unit):
+        """Put a WorkUnit into the pool."""
+        self._index(NonceAllocator(unit), unit.mask)
+        self.count += 1
+        self.hashes += 1<<unit.mask
+    
+    def _take(self, freeMask, mask):
+        bucket = self.buckets[freeMask]
+        key, seq, allocator = heapq.heappop(bucket)
+        if not bucket:
+            del self.buckets[freeMask]
+        
+        unit = allocator.take(freeMask, mask)
+        for m in xrange(mask, freeMask):
+            self._index(allocator, m)
+        
+        self.count += freeMask - mask - 1
+        self.hashes -= 1<<mask
+        return unit
+    
+    def pop(self, mask):
+        """Remove and return a WorkUnit with the specified mask, taken from
+        the first (that is, newest and smallest) free range that is big
+        enough, or None if there is no such range.
+        """
+        best = None
+        for freeMask, bucket in self.buckets.iteritems():
+            if freeMask < mask:
+                continue
+            
+            # The sort key is (age, mask), so on a tie the smaller range goes
+            # first.
+            if best is None or bucket[0][0] < best:
+                best = bucket[0][0]
+        
+        if best is None:
+            return None
+        return self._take(best[1], mask)
+    
+    def popLargest(self):
+        """Remove and return the largest free range as a WorkUnit (the newest
+        one, if there is a tie for largest), or None if the pool is empty.
+        """
+        if not self.buckets:
+            return None
+        mask = max(self.buckets)
+        return self._take(mask, mask)
@@ -20,23 +20,47 @@
 #
 # If you like it, send 5.00 BTC to 1DKSjFCdUmfivJEL5Gvj41oNspNMsfgy3S :)
 
+import time
 from twisted.internet import defer
 from minerutil import openURL
-from WorkUnit import WorkUnit
+from WorkUnit import WorkUnit, targetToInt
+from WorkPool import WorkPool
+from RateMeter import RateMeter
 
 class WorkProvider(object):
-    """A work provider maintains a list of WorkUnit objects, and serves as
+    """A work provider maintains a pool of WorkUnit objects, and serves as
     the manager/callback handler for the backend connection.
     """
     
     def __init__(self, server):
         self.server = server
         self.backend = None
-        self.work = []
+        self.work = WorkPool()
         self.template = None
         self.block = None
         self.deferreds = []
-        self.workRequested = False
+        self.workRequested = 0 # Units asked of the backend but not received
+        self.pushed = None # Work the backend is sending without being asked
+        self.rollBase = None
+        self.rolled = 0
+        
+        # Measurements used to size the work reserve.
+        self.consumed = RateMeter() # Hashes handed out to workers
+        self.shares = RateMeter() # Hashes represented by accepted results
+        self.latency = RateMeter(None) # Backend round-trip time, in seconds
+        self.requestedAt = None
+        self.stalls = 0 # Times a worker had to wait for work
+        
+        self.fifo = False
+        self.readFifo()
+    
+    def readFifo(self):
+        """Reads the work_fifo policy once, rather than on every comparison.
+        This is also called as a callback when work_fifo changes.
+        """
+        self.fifo = bool(self.server.getConfig('work_fifo', int, 0,
+                                               callback=self.readFifo))
+        self.work.rekey()
     
     def start(self):
         """Starts the WorkProvider; creates and establishes the backend
@@ -63,29 +87,58 @@ class WorkProvider(object):
         It is not necessarily logged in yet. After this callback, it will
         attempt to log in, and then call onWork when it gets its initial work.
         """
-        self.work = []
+        self.work.clear()
         self.template = None
+        self.rollBase = None
         
+    def onDisconnect(self):
+        """Called by the backend when it loses its connection, or fails to
+        make one. Any outstanding requests for work are lost with it.
+        """
+        self.workRequested = 0
+    onFailure = onDisconnect
+        
+    def onPush(self, wu):
+        """Called by the backend just before onWork, when the work wasn't
+        asked for (a long poll, or the first work for a new block).
+        """
+        self.pushed = wu
+    
     def onWork(self, wu):
         """Called by the backend when it receives a new WorkUnit."""
         
         work = WorkUnit(self, wu.data, wu.target, wu.mask)
         
-        self.workRequested = False
+        # Only work that answers a request counts against workRequested.
+        requested = wu is not self.pushed
+        self.pushed = None
+        if requested and self.workRequested:
+            # The latency is measured up to the first unit of each burst.
+            if self.requestedAt is not None:
+                self.latency.fold(time.time() - self.requestedAt)
+                self.requestedAt = None
+            self.workRequested -= 1
+        
+        # This is now the newest work from the backend, so any further work
+        # is rolled from it.
+        self.rollBase = work
+        self.rolled = 0
         
         # Check if this work is similar (that is, same prev. block) to the
         # template. The template is the WorkUnit to which all buffered work
         # must be similar.
         if self.template is not None and self.template.isSimilarTo(work):
-            self.work.append(work)
-            self.work.sort()
+            self.work.add(work)
         else:
             # Not similar. Reset the buffer, and inform every connected worker
             # that it needs to send new work.
             self.template = work
-            self.work = [work]
+            self.work.clear()
+            self.work.add(work)
             for worker in self.server.workers:
-                worker.sendWork()
+                worker.sendWork(newBlock=True)
+            if self.server.web is not None:
+                self.server.web.sendLongPolls()
         
         self.checkWork()
         
@@ -108,19 +161,105 @@ class WorkProvider(object):
     def checkWork(self):
         """Makes sure the WorkProvider has its work reserve met. If not,
         requests more work from the backend.
+        
+        Up to work_request_max of the units needed to refill the reserve are
+        requested at once; the backend decides how many of those requests to
+        run in parallel. The rest are asked for as the first ones come in.
         """
         
-        if self.workRequested:
-            return # We've already pestered the backend to get more work for us
+        reserve = self.getReserve()
+        
+        # Try to make up the difference locally before bothering the backend.
+        while self.work.hashes < reserve and self.rollWork():
+            pass
+        
+        if self.work.hashes >= reserve or not self.backend:
+            return
+        
+        # Assume the backend sends units like the ones it sent before.
+        if self.template is not None:
+            unitSize = 1<<self.template.mask
+        else:
+            unitSize = 1<<32
+        shortfall = reserve - self.work.hashes
+        needed = (shortfall + unitSize - 1)//unitSize - self.workRequested
+        needed = min(needed, self.server.getConfig('work_request_max', int,
+                                                   32) - self.workRequested)
         
-        hashes = 0L # Number of possible unique hashes.
-        for unit in self.work:
-            hashes += 1<<unit.mask
+        if needed > 0:
+            if not self.workRequested:
+                self.requestedAt = time.time()
+            self.backend.requestWork(needed)
+            self.workRequested += needed
+    
+    def getHashrate(self):
+        """Estimates the aggregate hashrate of the cluster, in hashes per
+        second, or returns None if there isn't enough data yet.
         
-        if hashes < self.server.getConfig('work_reserve', int, 0x200000000) \
-           and self.backend:
-            self.backend.requestWork()
-            self.workRequested = True
+        Accepted results are the better measure of how fast the miners are
+        actually hashing, so they're used when available; otherwise, the rate
+        at which nonce ranges are being handed out is used.
+        """
+        hashrate = self.shares.getRate()
+        if not hashrate:
+            # No results accepted in the last window says little about how
+            # fast the miners are going, so don't let it size the reserve.
+            hashrate = self.consumed.getRate()
+        return hashrate
+    
+    def getReserve(self):
+        """Returns the number of hashes that should be kept in reserve.
+        
+        The reserve is sized to cover work_reserve_time seconds of hashing at
+        the estimated hashrate, plus the time the backend takes to answer. If
+        no estimate is available (or work_reserve_time is 0) the fixed
+        work_reserve config variable is used instead.
+        
+        The estimate comes from results that miners turn in, so it is never
+        allowed past work_reserve_max.
+        """
+        seconds = self.server.getConfig('work_reserve_time', float, 10.0)
+        hashrate = self.getHashrate()
+        if not seconds or hashrate is None or hashrate <= 0:
+            return self.server.getConfig('work_reserve', int, 0x200000000)
+        
+        reserve = int(hashrate * (seconds + self.latency.getRate(0)))
+        return min(reserve, self.server.getConfig('work_reserve_max', int,
+                                                  1<<40))
+    
+    def getStats(self):
+        """Returns a dict describing the state of the work reserve."""
+        getLatency = getattr(self.backend, 'getLatency', None)
+        return {
+                "reserve": self.getReserve(),
+                "buffered": self.work.hashes,
+                "hashrate": self.getHashrate(),
+                "consumed": self.consumed.getRate(),
+                "latency": self.latency.getRate(),
+                "backendLatency": getLatency and getLatency('getwork'),
+                "submitLatency": getLatency and getLatency('submit'),
+                "stalls": self.stalls
+               }
+    
+    def rollWork(self):
+        """Makes a new WorkUnit locally, by advancing the timestamp of the
+        newest backend work by one more second, and adds it to the buffer.
+        
+        The ntime_roll config variable sets how many seconds past the original
+        timestamp work may be rolled. Rolling is disabled by default, as not
+        every backend accepts results with a modified timestamp.
+        
+        Returns False if no more work can be rolled.
+        """
+        if self.rollBase is None:
+            return False
+        
+        if self.rolled >= self.server.getConfig('ntime_roll', int, 0):
+            return False
+        
+        self.rolled += 1
+        self.work.add(self.rollBase.roll(self.rolled))
+        return True
     
     def getWork(self, desiredMask):
         """Retrieves an up-to-date WorkUnit from the provider. The unit is not
@@ -133,33 +272,29 @@ class WorkProvider(object):
         
         if not self.work:
             # Completely out of work, must defer.
+            self.stalls += 1
             d = defer.Deferred()
             self.deferreds.append((d, desiredMask))
             return d
         
-        # Strategy #1: Iterate through work list, find the first (that is,
-        # newest and smallest) available WorkUnit that is big enough, then
-        # subdivide it until it matches the size of desiredMask.
-        for unit in self.work:
-            if unit.mask < desiredMask:
-                continue
-            
-            # Found a unit big enough, pull it off the list and start splitting
-            self.work.remove(unit)
-            while unit.mask > desiredMask:
-                unit, other = unit.split()
-                self.work.append(other)
-            self.work.sort() # TODO: Insert work in place so we don't have to
-                             # sort afterward.
-            self.checkWork()
-            return defer.succeed(unit)
-        
-        # Strategy #2: There are no big enough units left, so just get the
-        # biggest (and newest, if there is a tie for biggest) unit.
-        workBySize = sorted(self.work, key=lambda x: x.mask, reverse=True)
-        self.work.remove(workBySize[0])
+        # Strategy #1: Carve a unit of desiredMask out of the first (that is,
+        # newest and smallest) free range that is big enough.
+        unit = self.work.pop(desiredMask)
+        if unit is None:
+            # Strategy #2: There are no big enough ranges left, so just get
+            # the biggest (and newest, if there is a tie for biggest) one.
+            unit = self.work.popLargest()
+        
+        self.consumed.add(1<<unit.mask)
         self.checkWork()
-        return defer.succeed(workBySize[0])
+        return defer.succeed(unit)
+    
+    def recordShare(self, target):
+        """Called by a worker connection when it accepts a result meeting the
+        specified target, for the purpose of estimating the hashrate.
+        """
+        # A result meeting target takes 2^256/(target+1) hashes on average.
+        self.shares.add((1<<256) // (targetToInt(target)+1))
     
     def sendResult(self, result):
         """Called by a worker connection when it finds a full-difficulty work
@@ -22,6 +22,42 @@
 
 import struct
 import hashlib
+from array import array
+
+# Array typecode for 32-bit words, used to byteswap headers in bulk.
+WORD = 'I' if array('I').itemsize == 4 else 'L'
+
+# The target of a difficulty-1 share.
+DIFF1 = 0xffff<<208
+
+def targetToInt(target):
+    """Converts a 32-byte (little-endian) target into an integer."""
+    return int(target[::-1].encode('hex'), 16)
+
+def intToTarget(value):
+    """Converts an integer into a 32-byte (little-endian) target."""
+    return ('%064x' % value).decode('hex')[::-1]
+
+def digestResults(results):
+    """Hashes a list of 80-byte results, returning each 32-byte digest."""
+    # Swap the results first; Bitcoin treats SHA-256 as if it loads words
+    # in little-endian, but Python's (true) implementation of SHA-256
+    # will load the words big-endian.
+    swapped = array(WORD, ''.join(results))
+    swapped.byteswap()
+    swapped = swapped.tostring()
+    
+    sha256 = hashlib.sha256
+    return [sha256(sha256(swapped[i:i+80]).digest()).digest()
+            for i in xrange(0, len(swapped), 80)]
+
+def hashResults(results):
+    """Hashes a list of 80-byte results, returning each hash as an integer
+    to compare against a target value.
+    """
+    # The hash, like the target, is a little-endian number.
+    return [int(hash[::-1].encode('hex'), 16)
+            for hash in digestResults(results)]
 
 class WorkUnit(object):
     """An actual unit of work to be done by miners. Includes all block header
@@ -33,8 +69,16 @@ class WorkUnit(object):
     blockexplorer, et al. This is so that SHA-256 can load the nonce (the
     third 32-bit word) in its native order and simply increment a 32-bit
     number 2^mask times, and not have to bother with bit alignment.
+    
+    The header fields used for matching and ordering are decoded once, when
+    the unit is made, and units split off the same header share them. There
+    can be many thousands of live units, so they have no __dict__, and the
+    full 80-byte header is only put together when it's asked for.
     """
     
+    __slots__ = ('prefix', 'nonce', 'timestamp', 'prevHash', 'provider',
+                 'target', 'targetValue', 'mask', 'original', 'sortKey')
+    
     WORK_LENGTH = 80
     
     def __init__(self, provider, data, target, mask=32):
@@ -43,104 +87,106 @@ class WorkUnit(object):
         
         # Correct the base nonce, since the base nonce might have mask
         # bits already set. Those need to be cleared.
-        misc, nonce = struct.unpack('<76sI', data)
+        prefix, nonce = struct.unpack('<76sI', data)
         nonce &= ~((1<<mask)-1)
-        self.data = struct.pack('<76sI', misc, nonce)
+        self.prefix = prefix # Everything but the nonce
+        self.nonce = nonce
+        self.timestamp, = struct.unpack('>I', prefix[68:72])
+        self.prevHash = prefix[4:36]
         
         self.provider = provider
         self.target = target
+        self.targetValue = targetToInt(target)
         self.mask = mask
         self.original = True
+        self.updateSortKey()
         
+    @property
+    def data(self):
+        """The 80-byte header, with this WorkUnit's base nonce."""
+        return self.prefix + struct.pack('<I', self.nonce)
+    
     def isSimilarTo(self, other):
         """Is this WorkUnit similar to the other WorkUnit? That is, do they
         have the same previous block hash?
         """
-        return self.data[4:36] == other.data[4:36]
+        return self.prevHash == other.prevHash
     
     def getTimestamp(self):
         """Return the UNIX timestamp associated with this WorkUnit."""
-        return struct.unpack('>I', self.data[68:72])[0]
+        return self.timestamp
     
     def getNonce(self):
         """Return the base nonce associated with this WorkUnit."""
         # NOTE: Nonce is treated as little-endian because it's more
         # efficient for the miners to increment the nonce in this manner!
-        return struct.unpack('<I', self.data[76:80])[0]
+        return self.nonce
     
-    def split(self):
-        """Subdivides this WorkUnit in half, returning two WorkUnits each with
-        half of this WorkUnit's nonce range. The mask in the returned WorkUnits
-        is decremented from this one's.
-        """
-        # The common part of the data (that is, everything but the nonce)
-        commonData = self.data[:76]
+    def updateSortKey(self):
+        """Recompute (and return) the key by which this WorkUnit is ordered.
         
-        nonce = self.getNonce()
-        left = WorkUnit(self.provider, struct.pack('<76sI', commonData, nonce),
-                        self.target, self.mask-1)
-        nonce |= 1<<(self.mask-1)
-        right = WorkUnit(self.provider, struct.pack('<76sI', commonData, nonce),
-                         self.target, self.mask-1)
+        The key has to be recomputed if the provider's work_fifo policy
+        changes.
+        """
+        timestamp = self.timestamp
         
-        left.original = right.original = False
+        # Timestamps are negated so they get sorted in descending order,
+        # unless the user wants the work buffer to be a fifo.
+        if not self.provider.fifo:
+            timestamp = -timestamp
         
-        return left, right
+        self.sortKey = (timestamp, self.mask) # Mask ascending.
+        return self.sortKey
     
-    def checkResult(self, result, target=None):
-        """Check a result against a specified target. If no target is
-        specified, the WorkUnit's own target is used.
+    def subrange(self, nonce, mask):
+        """Returns a WorkUnit covering the 2^mask nonces starting at nonce,
+        which must be an aligned part of this WorkUnit's range.
         
-        This function also verifies that the result is related to this WorkUnit
-        before checking the hash.
+        The new unit shares this one's header, target and provider, so none
+        of it needs to be unpacked, converted or copied again.
         """
-        
-        if target is None:
-            target = self.target
-        
-        if len(result) != len(self.data):
+        unit = WorkUnit.__new__(WorkUnit)
+        unit.prefix = self.prefix
+        unit.nonce = nonce
+        unit.timestamp = self.timestamp
+        unit.prevHash = self.prevHash
+        unit.provider = self.provider
+        unit.target = self.target
+        unit.targetValue = self.targetValue
+        unit.mask = mask
+        unit.original = self.original and mask == self.mask
+        unit.sortKey = (self.sortKey[0], mask)
+        return unit
+    
+    def roll(self, seconds):
+        """Returns a new WorkUnit identical to this one, except with its
+        timestamp advanced by the specified number of seconds. Since the
+        timestamp is part of the header, the new unit covers an entirely new
+        set of hashes.
+        """
+        timestamp = self.timestamp + seconds
+        data = (self.prefix[:68] + struct.pack('>I', timestamp) +
+                self.prefix[72:] + struct.pack('<I', self.nonce))
+        return WorkUnit(self.provider, data, self.target, self.mask)
+    
+    def matchesResult(self, result):
+        """Returns True if the result is for this WorkUnit: same header, and a
+        nonce within this WorkUnit's range. The hash is not checked.
+        """
+        if len(result) != self.WORK_LENGTH:
             return False
         
-        if result[:76] != self.data[:76]:
+        if result[:76] != self.prefix:
             return False
         
         maskBits = (1<<self.mask)-1
         resultNonce, = struct.unpack('<I', result[76:80])
         
-        if (self.getNonce() | maskBits) != (resultNonce | maskBits):
-            return False
-        
-        # Swap the result now; Bitcoin treats SHA-256 as if it loads words
-        # in little-endian, but Python's (true) implementation of SHA-256
-        # will load the words big-endian.
-        swappedResult = ''
-        for i in range(80):
-            swappedResult += result[i^3]
-        
-        hash = hashlib.sha256(hashlib.sha256(swappedResult).digest()).digest()
-        
-        # Compare every byte in the target and hash in little-endian order
-        for t,h in zip(target[::-1], hash[::-1]):
-            if ord(t) > ord(h):
-                return True
-            elif ord(t) < ord(h):
-                return False
-        return True
+        return (self.nonce | maskBits) == (resultNonce | maskBits)
     
     def __cmp__(self, other):
         """Compare implemented so that WorkUnits are sorted with the newest
         at the beginning of a list. If two WorkUnits share an equal age, then
         the smaller WorkUnit comes first.
         """
-        # The timestamps are swapped so they get sorted in descending order.
-        comparison = cmp(other.getTimestamp(), self.getTimestamp())
-        
-        # If the user wants the work buffer to be a fifo, swap the comparison
-        # back to ascending order.
-        if self.provider.server.getConfig('work_fifo', int, 0):
-            comparison = -comparison
-        
-        if comparison != 0:
-            return comparison
-        else:
-            return cmp(self.mask, other.mask) # Not swapped: Ascending order.
\ No newline at end of file
+        return cmp(self.sortKey, other.sortKey)
\ No newline at end of file
@@ -23,16 +23,27 @@
 import hashlib
 
 class WorkerAccount(object):
+    """A worker account, along with all of its data variables.
+    
+    Account data is loaded in one query when the account is constructed, and
+    is kept up to date by setData, so reads never go to the database. Don't
+    construct these directly; use ClusterServer.getAccount, which caches them.
+    """
+    
     def __init__(self, server, username):
         self.server = server
         self.username = username
         self.id = None # Should get set if it finds the
                        # user's entry in the database.
+        self.data = {}
     
-        for id, in self.server.db.execute('SELECT id FROM workers WHERE '
-                                          'username=? LIMIT 1;',
-                                          (self.username,)):
+        for id, var, value in self.server.db.execute(
+            'SELECT workers.id, workerdata.var, workerdata.value FROM workers '
+            'LEFT JOIN workerdata ON workerdata.worker=workers.id '
+            'WHERE workers.username=?;', (self.username,)):
             self.id = id
+            if var is not None:
+                self.data[var] = value
     
     def exists(self):
         """Does this worker exist in the database?"""
@@ -45,6 +56,8 @@ class WorkerAccount(object):
         self.server.db.execute('DELETE FROM workerdata WHERE worker=?;',
                                (self.id,))
         self.id = None
+        self.data = {}
+        self.server.forgetAccount(self)
     
     def create(self):
         """Create this worker in the database and set the ID."""
@@ -61,41 +74,33 @@ class WorkerAccount(object):
         
         It works very much like PoolServer.getConfig.
         """
-        # This should only loop once.
-        for row in self.server.db.execute('SELECT value FROM workerdata '
-                                          'WHERE worker=? AND var=? LIMIT 1;',
-                                          (self.id, var)):
-            try:
-                value = type(row[0])
-            except (TypeError, ValueError):
-                return default
-            else:
-                return value # Type-converted
+        if var not in self.data:
+            # Variable is not present in the database.
+            return default
         
-        # Variable is not present in the database.
-        return default
+        try:
+            return type(self.data[var])
+        except (TypeError, ValueError):
+            return default
     
     def getAllData(self):
         """Retrieves all data values for this worker."""
-        data = {}
-        for var, value in self.server.db.execute('SELECT var, value FROM '
-                                                 'workerdata WHERE worker=?;',
-                                                 (self.id,)):
-            data[var] = value
-        return data
+        return dict(self.data)
     
     def setData(self, var, value):
         """Sets a data variable in this worker account.
         
         It works very much like PoolServer.setConfig.
         """
-        # There might be an old definition, so take it out if so.
-        self.server.db.execute('DELETE FROM workerdata WHERE worker=? '
-                               'AND var=?;', (self.id, var))
-        if value is not None: # Setting to None means the variable gets cleared.
-            self.server.db.execute('INSERT INTO workerdata (worker,var,value) '
-                                   'VALUES (?,?,?);',
+        if value is not None:
+            self.server.db.execute('INSERT OR REPLACE INTO workerdata '
+                                   '(worker,var,value) VALUES (?,?,?);',
                                    (self.id, var, str(value)))
+            self.data[var] = str(value)
+        else: # Setting to None means the variable gets cleared.
+            self.server.db.execute('DELETE FROM workerdata WHERE worker=? '
+                                   'AND var=?;', (self.id, var))
+            self.data.pop(var, None)
     
     def getConfig(self, var, type=str, default=None):
         """Convenience function to look up per-account configuration.
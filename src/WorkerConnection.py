@@ -21,8 +21,35 @@
 # If you like it, send 5.00 BTC to 1DKSjFCdUmfivJEL5Gvj41oNspNMsfgy3S :)
 
 import time
-from minerutil.MMPProtocol import MMPProtocolBase
-from WorkerAccount import WorkerAccount
+from zope.interface import implements
+from twisted.internet import reactor, defer
+from twisted.internet.interfaces import IPushProducer
+from minerutil.MMPProtocol import MMPProtocolBase, RECORD_WORK, \
+    RECORD_ACCEPTED, RECORD_REJECTED
+from WorkHistory import WorkHistory
+from WorkUnit import DIFF1, targetToInt, intToTarget
+
+class WriteMonitor(object):
+    """Registered as the producer on a WorkerConnection's transport, so the
+    transport tells the connection when its write buffer fills up and when
+    it has drained again.
+    
+    This is a separate object because LineReceiver already uses the
+    producer methods to pause reading, not writing.
+    """
+    implements(IPushProducer)
+    
+    def __init__(self, connection):
+        self.connection = connection
+    
+    def pauseProducing(self):
+        self.connection.writeStalled()
+    
+    def resumeProducing(self):
+        self.connection.writeResumed()
+    
+    def stopProducing(self):
+        pass
 
 class WorkerConnection(MMPProtocolBase):
     """This class represents an actual worker connected to the server.
@@ -34,23 +61,98 @@ class WorkerConnection(MMPProtocolBase):
     account = None
     connectedAt = None
     
-    sendingWork = False
+    pendingWork = 0 # Units of work being fetched for the worker
     sentTarget = None
+    
+    # Variable share difficulty; see getShareTarget.
+    shareTarget = None
+    shareCount = 0
+    retargetedAt = None
+    
+    # Backpressure; see writeStalled.
+    stalledAt = None # When the transport's write buffer filled up
+    stalledBytes = 0 # Bytes written since then
+    stallTimer = None
+    wantedWork = 0 # Units of work held back while stalled
 
     commands = {
         'LOGIN':    (str, str),
         'META':     (str, str),
-        'MORE':     (),
+        'MORE':     (int,),
         'RESULT':   (str,),
+        'BINARY':   (),
     }
     
     def connectionMade(self):
-        self.factory.workers.append(self)
+        self.factory.workers.add(self)
         self.connectedAt = time.time()
         self.meta = {}
-        self.work = []
+        self.work = WorkHistory()
+        self.transport.registerProducer(WriteMonitor(self), True)
     def connectionLost(self, reason):
         self.factory.workers.remove(self)
+        if self.stallTimer is not None and self.stallTimer.active():
+            self.stallTimer.cancel()
+        self.stallTimer = None
+    
+    def writeStalled(self):
+        """Called when the worker isn't reading as fast as we're writing.
+        
+        No new work is sent until the buffer drains. A worker that stays
+        stalled for mmp_stall_timeout seconds, or that has had more than
+        mmp_buffer_limit bytes written to it in that time, is dropped.
+        """
+        # The transport calls this on every write while its buffer is full.
+        if self.stalledAt is not None:
+            return
+        self.stalledAt = time.time()
+        self.stalledBytes = 0
+        timeout = self.factory.getConfig('mmp_stall_timeout', int, 60)
+        if timeout > 0:
+            self.stallTimer = reactor.callLater(timeout, self.dropStalled)
+    
+    def writeResumed(self):
+        """Called when the write buffer has drained."""
+        if self.transport.disconnecting:
+            # Leave the stall timer to deal with a worker on its way out.
+            return
+        self.stalledAt = None
+        self.stalledBytes = 0
+        if self.stallTimer is not None and self.stallTimer.active():
+            self.stallTimer.cancel()
+        self.stallTimer = None
+        
+        wanted, self.wantedWork = self.wantedWork, 0
+        if wanted:
+            self.sendWork(wanted)
+    
+    def dropStalled(self):
+        """Disconnects a stalled worker without waiting for its buffer to
+        flush, since it may never do so.
+        """
+        self.stallTimer = None
+        self.transport.unregisterProducer()
+        abort = getattr(self.transport, 'abortConnection', None)
+        if abort is not None:
+            abort()
+        else:
+            self.transport.loseConnection()
+    
+    def _wrote(self, size):
+        if self.stalledAt is None:
+            return
+        self.stalledBytes += size
+        limit = self.factory.getConfig('mmp_buffer_limit', int, 262144)
+        if limit > 0 and self.stalledBytes > limit:
+            self.dropStalled()
+    
+    def sendLine(self, line):
+        MMPProtocolBase.sendLine(self, line)
+        self._wrote(len(line) + 3)
+    
+    def sendRecord(self, type, payload):
+        MMPProtocolBase.sendRecord(self, type, payload)
+        self._wrote(len(type) + len(payload))
     
     def illegalCommand(self, cmd):
         self.kick('Invalid %s command!' % cmd)
@@ -58,14 +160,18 @@ class WorkerConnection(MMPProtocolBase):
     def sendMsg(self, msg):
         """Send a message to the worker.
         
-        This will typically be printed on the worker's console.
+        This will typically be printed on the worker's console. Messages
+        longer than the worker will accept in one line are cut short.
         """
-        self.sendLine('MSG :' + msg)
+        self.sendLine(('MSG :' + msg)[:self.MAX_LENGTH])
     
     def kick(self, reason=None):
         """Kicks the worker off, with an optional reason."""
         if reason is not None:
             self.sendMsg('ERROR: ' + reason)
+        # A registered producer would be resumed, rather than the connection
+        # closed, once the buffer drains.
+        self.transport.unregisterProducer()
         self.transport.loseConnection()
     
     def checkClones(self):
@@ -92,38 +198,92 @@ class WorkerConnection(MMPProtocolBase):
         if self.factory.workProvider.block is not None:
             self.sendLine('BLOCK %d' % self.factory.workProvider.block)
     
-    def sendWork(self):
-        """Sends work to this client, unless the client is waiting on work
-        already.
+    def getShareTarget(self, w):
+        """Returns the target that this connection should submit results for
+        on the WorkUnit w.
+        
+        If the share_rate config variable is set, the target is adjusted so
+        the worker submits about share_rate results per minute, retargeting
+        every share_retarget seconds. The target is never harder than w's own
+        target, so no full-difficulty solution goes unreported, nor easier
+        than difficulty 1 (unless w's own target is easier).
         """
-        if self.sendingWork or not self.account:
+        rate = self.account.getConfig('share_rate', float, 0)
+        if not rate:
+            self.shareTarget = None
+            return w.target
+        
+        now = time.time()
+        hardest = w.targetValue
+        easiest = max(DIFF1, hardest)
+        
+        if self.shareTarget is None:
+            self.shareTarget = easiest
+            self.shareCount = 0
+            self.retargetedAt = now
+        
+        interval = self.account.getConfig('share_retarget', float, 60.0)
+        elapsed = now - self.retargetedAt
+        # Retarget early if the worker is flooding us with results.
+        if elapsed >= interval or self.shareCount > 4*rate*interval/60:
+            actual = self.shareCount * 60 / max(elapsed, 1)
+            factor = rate/actual if actual else 4
+            factor = min(max(factor, 0.25), 4)
+            self.shareTarget = int(self.shareTarget * factor)
+            self.shareCount = 0
+            self.retargetedAt = now
+        
+        self.shareTarget = min(max(self.shareTarget, hardest), easiest)
+        return intToTarget(self.shareTarget)
+    
+    def sendWork(self, count=1, newBlock=False):
+        """Sends count units of work to this client. newBlock is set when the
+        work is pushed out because the block changed.
+        """
+        if not self.account:
             return
         
-        self.sendingWork = True
+        if self.stalledAt is not None:
+            # Hold it back until the worker catches up; by then any work
+            # we'd send now would probably be stale anyway. Units the
+            # worker asked for are still owed, but however many blocks go by,
+            # one unit is enough to tell it about the latest.
+            if newBlock:
+                self.wantedWork = max(self.wantedWork, 1)
+            else:
+                self.wantedWork += count
+            return
+        
+        self.pendingWork += count
         
         mask = self.account.getConfig('work_mask', int, 32)
-        d = self.factory.workProvider.getWork(mask)
-        
-        def gotWork(w):
-            self.sendingWork = False
-            
-            if self.work and not self.work[0].isSimilarTo(w):
-                self.work = []
-            self.work.append(w)
-            
-            if self.sentTarget != w.target:
-                self.sendLine('TARGET %s' % w.target.encode('hex'))
-                self.sentTarget = w.target
-            
+        for i in range(count):
+            d = self.factory.workProvider.getWork(mask)
+            d.addCallback(self._gotWork)
+    
+    def _gotWork(self, w):
+        self.pendingWork -= 1
+        
+        target = self.getShareTarget(w)
+        
+        self.work.limit = self.account.getConfig('work_history', int, 256)
+        self.work.maxAge = self.account.getConfig('work_expiry', int, 0)
+        self.work.add(w, target)
+        
+        if self.sentTarget != target:
+            self.sendLine('TARGET %s' % target.encode('hex'))
+            self.sentTarget = target
+        
+        if self.binaryOut:
+            self.sendRecord(RECORD_WORK, w.data + chr(w.mask))
+        else:
             self.sendLine('WORK %s %d' % (w.data.encode('hex'), w.mask))
-            
-        d.addCallback(gotWork)
     
     def cmd_LOGIN(self, username, password):
         if self.account is not None:
             return self.kick('Received duplicate LOGIN command!')
         
-        self.account = WorkerAccount(self.factory, username)
+        self.account = self.factory.getAccount(username)
         if not self.account.exists():
             loggedIn = False
         else:
@@ -131,6 +291,8 @@ class WorkerConnection(MMPProtocolBase):
         if not loggedIn:
             return self.kick('Login failed. Please check your account details.')
         
+        self.factory.workers.login(self)
+        
         if not self.checkClones():
             return self.kick('Connection limit exceeded!')
         
@@ -140,6 +302,8 @@ class WorkerConnection(MMPProtocolBase):
             for line in motd.splitlines():
                 self.sendMsg(line)
         
+        # Tell the client how much work it may have on the way at once.
+        self.sendLine('QUEUE %d' % self.getQueueLimit())
         self.sendBlock()
         self.sendWork()
     
@@ -147,29 +311,81 @@ class WorkerConnection(MMPProtocolBase):
         # TODO: Limit the number of METAs a worker can store.
         self.meta[var] = value
     
-    def cmd_MORE(self):
+    def getQueueLimit(self):
+        """Returns the most units of work the client may have asked for and
+        not yet been sent, according to the work_queue config variable.
+        """
+        return max(self.account.getConfig('work_queue', int, 4), 1)
+    
+    def cmd_MORE(self, count=1):
         if self.account:
-            self.sendWork()
+            # The client was told the limit with QUEUE, so it shouldn't ask
+            # for more than that; if it does, it gets no more than that.
+            room = self.getQueueLimit() - self.pendingWork - self.wantedWork
+            count = min(max(count, 1), room)
+            if count > 0:
+                self.sendWork(count)
     
-    def _result(self, hex):
-        """Returns True/False depending on whether the RESULT is good."""
-        try:
-            result = hex.decode('hex')
-        except (TypeError, ValueError):
-            return False
+    def cmd_BINARY(self):
+        if not self.account:
+            return
         
-        for w in self.work:
-            if w.checkResult(result):
-                return True
+        if not self.binaryOut:
+            # The client asks for binary mode. Agree, then switch output.
+            self.sendLine('BINARY')
+            self.binaryOut = True
+        elif not self.binaryIn:
+            # The client confirms it has switched its output.
+            self.startBinaryInput()
+    
+    def _result(self, result):
+        """Returns a Deferred that fires with True/False depending on whether
+        the result is good. Good results that are also full-difficulty
+        solutions are passed on to the WorkProvider.
+        """
+        w, target = self.work.claim(result)
+        if w is None:
+            return defer.succeed(False)
         
-        return False
+        d = self.factory.verifier.verify(w, result, target)
+        d.addCallback(self._countShare)
+        return d
+    
+    def _countShare(self, accepted):
+        if accepted:
+            self.shareCount += 1
+        return accepted
     
     def cmd_RESULT(self, hex):
         if not self.account:
             return
-        if self._result(hex):
-            # Decoding hex is safe, because self._result checks that.
-            self.factory.workProvider.sendResult(hex.decode('hex'))
+        try:
+            result = hex.decode('hex')
+        except (TypeError, ValueError):
+            result = None
+        
+        if result is None:
+            d = defer.succeed(False)
+        else:
+            d = self._result(result)
+        d.addCallback(self._sendTextVerdict, result, hex)
+    
+    def _sendTextVerdict(self, accepted, result, hex):
+        if self.binaryOut and result is not None and len(result) == 80:
+            # The client sent this just before switching to binary mode.
+            self._sendVerdict(accepted, result)
+        elif accepted:
             self.sendLine('ACCEPTED :%s' % hex)
         else:
-            self.sendLine('REJECTED :%s' % hex)
\ No newline at end of file
+            self.sendLine('REJECTED :%s' % hex)
+    
+    def rec_RESULT(self, result):
+        if not self.account:
+            return
+        self._result(result).addCallback(self._sendVerdict, result)
+    
+    def _sendVerdict(self, accepted, result):
+        if accepted:
+            self.sendRecord(RECORD_ACCEPTED, result)
+        else:
+            self.sendRecord(RECORD_REJECTED, result)
\ No newline at end of file
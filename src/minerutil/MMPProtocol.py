@@ -19,59 +19,187 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 # THE SOFTWARE.
 
+import struct
 from twisted.internet import reactor, defer
 from twisted.internet.protocol import ReconnectingClientFactory
 from twisted.protocols.basic import LineReceiver
 
 from ClientBase import *
 
+# Record types for binary framing. Once binary mode is negotiated, each
+# direction of the connection is a stream of records, each starting with one
+# of these type bytes. Text lines are carried as a LINE record with a 16-bit
+# length; the rest are fixed-size.
+RECORD_LINE = '\x00'
+RECORD_WORK = '\x01' # 80-byte work, then 1-byte mask
+RECORD_RESULT = '\x02' # 80-byte result
+RECORD_ACCEPTED = '\x03' # 80-byte result
+RECORD_REJECTED = '\x04' # 80-byte result
+
+RECORD_NAMES = {
+    RECORD_WORK: 'WORK',
+    RECORD_RESULT: 'RESULT',
+    RECORD_ACCEPTED: 'ACCEPTED',
+    RECORD_REJECTED: 'REJECTED',
+}
+
+RECORD_SIZES = {
+    RECORD_WORK: 81,
+    RECORD_RESULT: 80,
+    RECORD_ACCEPTED: 80,
+    RECORD_REJECTED: 80,
+}
+
 class MMPProtocolBase(LineReceiver):
+    """Base for both ends of an MMP connection.
+    
+    MMP is line-based text by default. Either end may switch to binary framing
+    once the client has logged in: the client sends BINARY, and the server
+    answers BINARY and switches its output. The client then switches its
+    input, confirms with BINARY, and switches its output, after which the
+    server switches its input. A server that doesn't know BINARY ignores it,
+    and the connection stays text.
+    
+    In binary mode, records are dispatched to rec_NAME(payload) handlers.
+    """
+    
     delimiter = '\r\n'
     commands = {} # To be overridden by superclasses...
+    
+    binaryIn = False
+    binaryOut = False
+    _recordBuffer = ''
+    
+    def sendLine(self, line):
+        if self.binaryOut:
+            if len(line) > 0xFFFF:
+                raise ValueError('%d-byte line is too long for a binary '
+                                 'LINE record' % len(line))
+            self.transport.write(RECORD_LINE + struct.pack('>H', len(line)) +
+                                 line)
+        else:
+            LineReceiver.sendLine(self, line)
+    
+    def sendRecord(self, type, payload):
+        """Send a fixed-size binary record. Only valid in binary mode."""
+        self.transport.write(type + payload)
+    
+    def startBinaryInput(self):
+        """Everything received after this point is binary records."""
+        self.binaryIn = True
+        self.setRawMode()
+    
+    def rawDataReceived(self, data):
+        buffer = self._recordBuffer + data
+        offset = 0
+        
+        while offset < len(buffer) and not self.transport.disconnecting:
+            type = buffer[offset]
+            if type == RECORD_LINE:
+                if len(buffer) - offset < 3:
+                    break
+                size, = struct.unpack('>H', buffer[offset+1:offset+3])
+                if len(buffer) - offset < 3 + size:
+                    break
+                line = buffer[offset+3:offset+3+size]
+                offset += 3 + size
+                self.lineReceived(line)
+                continue
+            
+            size = RECORD_SIZES.get(type)
+            if size is None:
+                # There's no telling where the next record starts, so the
+                # rest of the stream is useless.
+                self._recordBuffer = ''
+                self.illegalCommand('binary')
+                self.transport.loseConnection()
+                return
+            if len(buffer) - offset < 1 + size:
+                break
+            payload = buffer[offset+1:offset+1+size]
+            offset += 1 + size
+            
+            function = getattr(self, 'rec_' + RECORD_NAMES[type], None)
+            if function is None:
+                self.illegalCommand(RECORD_NAMES[type])
+            else:
+                function(payload)
+        
+        self._recordBuffer = buffer[offset:]
 
     def lineReceived(self, line):
         # The protocol uses IRC-style argument passing. i.e. space-separated
         # arguments, with the final one optionally beginning with ':' (in which
         # case, the final argument is the only one that may contain spaces).
-        halves = line.split(' :', 1)
-        args = halves[0].split(' ') # The space-separated part.
-        if len(halves) == 2:
-            args.append(halves[1]) # The final argument; could contain spaces.
-        
-        cmd = args[0]
-        args = args[1:]
+        cmd, space, rest = line.partition(' ')
+        if not space:
+            args = []
+        elif rest.startswith(':'):
+            args = [rest[1:]]
+        elif ' :' in rest:
+            head, tail = rest.split(' :', 1)
+            args = head.split(' ') # The space-separated part.
+            args.append(tail) # The final argument; could contain spaces.
+        else:
+            # The common case, e.g. RESULT <hex> or WORK <hex> <mask>: a
+            # single split produces the argument list.
+            args = rest.split(' ')
         
         self.handleCommand(cmd, args)
     
+    @classmethod
+    def _compileDispatch(cls):
+        """Builds the class's dispatch table out of its commands dict. Each
+        entry is (function, converters, minimum args, maximum args), where
+        converters lists (index, type) for every argument that isn't a str.
+        """
+        dispatch = {}
+        for cmd, types in cls.commands.items():
+            function = getattr(cls, 'cmd_' + cmd, None)
+            if function is None:
+                continue
+            function = function.im_func
+            
+            # Trailing arguments may be omitted if the handler has defaults
+            # for them.
+            optional = len(function.func_defaults or ())
+            converters = tuple((i,t) for i,t in enumerate(types) if t is not str)
+            dispatch[cmd] = (function, converters, len(types) - optional,
+                             len(types))
+        
+        cls._dispatch = dispatch
+        return dispatch
+    
     def handleCommand(self, cmd, args):
         """Handle a parsed command.
         
         This function takes care of converting arguments to their appropriate
         types and then calls the function handler. If a command is unknown,
-        it is dispatched to illegalCommand.
+        it is ignored; if its arguments are bad, it is dispatched to
+        illegalCommand.
         """
-        function = getattr(self, 'cmd_' + cmd, None)
+        # Every class gets its own table, built the first time it's needed.
+        dispatch = self.__class__.__dict__.get('_dispatch')
+        if dispatch is None:
+            dispatch = self._compileDispatch()
         
-        if function is None or cmd not in self.commands:
+        entry = dispatch.get(cmd)
+        if entry is None:
             return
+        function, converters, minArgs, maxArgs = entry
         
-        types = self.commands[cmd]
+        if not minArgs <= len(args) <= maxArgs:
+            return self.illegalCommand(cmd)
         
-        if len(types) != len(args):
-            converted = False
-        else:
-            converted = True # Unless the below loop has a conversion problem.
-            for i,t in enumerate(types):
-                try:
-                    args[i] = t(args[i])
-                except (ValueError, TypeError):
-                    converted = False
-                    break
+        for i,t in converters:
+            if i >= len(args):
+                break
+            try:
+                args[i] = t(args[i])
+            except (ValueError, TypeError):
+                return self.illegalCommand(cmd)
         
-        if converted:
-            function(*args)
-        else:
-            self.illegalCommand(cmd)
+        function(self, *args)
     
     def illegalCommand(self, cmd):
         pass # To be overridden by superclasses...
@@ -86,6 +214,12 @@ class MMPClientProtocol(MMPProtocolBase, ClientBase):
     
     metaSent = False
     
+    queue = None # Prefetched work, not yet given to the handler
+    requested = 0 # Units the handler asked for that it hasn't gotten yet
+    outstanding = 0 # Units asked of the server that haven't arrived yet
+    moreLimit = 1 # Most units that may be outstanding; see cmd_QUEUE
+    lastWork = None
+    
     commands = {
         'MSG':      (str,),
         'TARGET':   (str,),
@@ -93,9 +227,12 @@ class MMPClientProtocol(MMPProtocolBase, ClientBase):
         'BLOCK':    (int,),
         'ACCEPTED': (str,),
         'REJECTED': (str,),
+        'BINARY':   (),
+        'QUEUE':    (int,),
     }
     
     def connectionMade(self):
+        self.queue = []
         self.factory.connection = self
         self.runCallback('connect')
         self.sendLine('LOGIN %s :%s' % (self.factory.username,
@@ -104,6 +241,8 @@ class MMPClientProtocol(MMPProtocolBase, ClientBase):
         for var,value in self.factory.meta.items():
             self.sendMeta(var, value)
         self.metaSent = True
+        if self.factory.binary:
+            self.sendLine('BINARY')
     
     def connectionLost(self, reason):
         self.runCallback('disconnect')
@@ -126,6 +265,25 @@ class MMPClientProtocol(MMPProtocolBase, ClientBase):
         if len(t) == 32:
             self.target = t
     
+    def cmd_QUEUE(self, limit):
+        # The server says how many units may be on their way at once. Servers
+        # that don't say so are only asked for one at a time.
+        self.moreLimit = max(limit, 1)
+    
+    def cmd_BINARY(self):
+        # The server has agreed to binary mode, and switched its output.
+        if not self.factory.binary or self.binaryIn:
+            return
+        self.sendLine('BINARY')
+        self.binaryOut = True
+        self.startBinaryInput()
+    
+    def sendResult(self, result):
+        if self.binaryOut:
+            self.sendRecord(RECORD_RESULT, result)
+        else:
+            self.sendLine('RESULT ' + result.encode('hex'))
+    
     def cmd_WORK(self, work, mask):
         try:
             data = work.decode('hex')
@@ -133,21 +291,86 @@ class MMPClientProtocol(MMPProtocolBase, ClientBase):
             return
         if len(data) != 80:
             return
+        self.gotWork(data, mask)
+    
+    def rec_WORK(self, payload):
+        self.gotWork(payload[:80], ord(payload[80]))
+    
+    def gotWork(self, data, mask):
         wu = AssignedWork()
         wu.data = data
         wu.mask = mask
         wu.target = self.target
-        self.runCallback('work', wu)
+        
+        if self.outstanding:
+            self.outstanding -= 1
+        
+        # Work for a new block (including the first work after login) goes
+        # straight to the handler, and anything prefetched is now stale.
+        # Otherwise, it's given to the handler only if it asked for it.
+        if self.lastWork is None or self.lastWork.data[4:36] != data[4:36]:
+            self.queue = []
+            self.giveWork(wu)
+        else:
+            self.queue.append(wu)
+            self.giveQueuedWork()
+        self.refillQueue()
+        
         # Since the server is giving work, we know it has accepted our
         # login details, so we can reset the factory's reconnect delay.
-        self.factory.resetDelay()
+        # (resetDelay also turns reconnecting back on, so not after a
+        # disconnect.)
+        if self.factory.continueTrying:
+            self.factory.resetDelay()
+    
+    def giveWork(self, wu):
+        if self.requested:
+            self.requested -= 1
+        else:
+            # New-block work that the handler didn't ask for.
+            self.runCallback('push', wu)
+        self.lastWork = wu
+        self.runCallback('work', wu)
+    
+    def giveQueuedWork(self):
+        """Give the handler as much of the work it asked for as is queued."""
+        while self.requested and self.queue:
+            self.giveWork(self.queue.pop(0))
+    
+    def refillQueue(self):
+        """Ask the server for enough work to cover what the handler is waiting
+        for, plus the factory's prefetch depth, without having more than the
+        server's limit outstanding. The rest is asked for as work arrives.
+        """
+        wanted = (self.requested + self.factory.prefetch - len(self.queue) -
+                  self.outstanding)
+        count = min(wanted, self.moreLimit - self.outstanding)
+        if count <= 0:
+            return
+        self.outstanding += count
+        if count == 1:
+            self.sendLine('MORE')
+        else:
+            self.sendLine('MORE %d' % count)
     
     def cmd_BLOCK(self, block):
         self.runCallback('block', block)
     
     def cmd_ACCEPTED(self, data):
-        self.factory._resultReturned(data, True)
+        self._resultReturned(data, True)
     def cmd_REJECTED(self, data):
+        self._resultReturned(data, False)
+    
+    def _resultReturned(self, data, accepted):
+        try:
+            data = data.decode('hex')
+        except (TypeError, ValueError):
+            return
+        self.factory._resultReturned(data, accepted)
+    
+    def rec_ACCEPTED(self, data):
+        self.factory._resultReturned(data, True)
+    def rec_REJECTED(self, data):
         self.factory._resultReturned(data, False)
 
 class MMPClient(ReconnectingClientFactory, ClientBase):
@@ -167,6 +390,8 @@ class MMPClient(ReconnectingClientFactory, ClientBase):
     
     deferreds = {}
     connection = None
+    prefetch = 1 # Units of work to keep queued up locally
+    binary = False # Whether to ask the server for binary framing
     
     def __init__(self, handler, host, port, username, password):
         self.handler = handler
@@ -202,13 +427,16 @@ class MMPClient(ReconnectingClientFactory, ClientBase):
         
         self.stopTrying()
     
-    def requestWork(self):
-        """If connected, ask the server for more work. The request is not sent
-        if the client isn't connected, since the server will provide work upon
-        next login anyway.
+    def requestWork(self, count=1):
+        """If connected, get count more units of work. They come out of the
+        local prefetch queue if possible, and are otherwise asked of the
+        server. The request is not sent if the client isn't connected, since
+        the server will provide work upon next login anyway.
         """
         if self.connection is not None:
-            self.connection.sendLine('MORE')
+            self.connection.requested += count
+            self.connection.giveQueuedWork()
+            self.connection.refillQueue()
     
     def setMeta(self, var, value):
         """Set a metavariable, which gets sent to the server on-connect (or
@@ -248,7 +476,7 @@ class MMPClient(ReconnectingClientFactory, ClientBase):
         else:
             self.deferreds[result] = d
         
-        self.connection.sendLine('RESULT ' + result.encode('hex'))
+        self.connection.sendResult(result)
         return d
     
     def _purgeDeferreds(self):
@@ -257,11 +485,6 @@ class MMPClient(ReconnectingClientFactory, ClientBase):
         self.deferreds = {}
     
     def _resultReturned(self, data, accepted):
-        try:
-            data = data.decode('hex')
-        except (TypeError, ValueError):
-            return
-        
         if data in self.deferreds:
             self.deferreds[data].callback(accepted)
             del self.deferreds[data]
\ No newline at end of file
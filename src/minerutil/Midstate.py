@@ -20,6 +20,7 @@
 # THE SOFTWARE.
 
 import struct
+from collections import OrderedDict
 
 # Some SHA-256 constants...
 K = [
@@ -45,6 +46,13 @@ F0 = 0x9b05688c
 G0 = 0x1f83d9ab
 H0 = 0x5be0cd19
 
+M32 = 0xFFFFFFFF
+
+# Finished midstates, keyed on the 64-byte block. Every unit split off the
+# same backend header shares its first block, so this gets a lot of hits.
+CACHE_SIZE = 1024
+_cache = OrderedDict()
+
 def rotateright(i,p):
     """i>>>p"""
     p &= 0x1F # p mod 32
@@ -53,15 +61,40 @@ def rotateright(i,p):
 def addu32(*i):
     return sum(list(i))&0xFFFFFFFF
 
+def expandSchedule(data):
+    """Unpacks a 64-byte block and extends it to the full 64-word SHA-256
+    message schedule.
+    """
+    w = list(struct.unpack('<16I', data))
+    append = w.append
+    # The rotates below leave junk above bit 31; the final mask discards it.
+    for i in xrange(16, 64):
+        x = w[i-15]
+        y = w[i-2]
+        append((w[i-16] + w[i-7] +
+                (((x >> 7) | (x << 25)) ^ ((x >> 18) | (x << 14)) ^ (x >> 3)) +
+                (((y >> 17) | (y << 15)) ^ ((y >> 19) | (y << 13)) ^ (y >> 10))
+               ) & M32)
+    return w
+
 def calculateMidstate(data, state=None, rounds=None):
     """Given a 512-bit (64-byte) block of (little-endian byteswapped) data,
     calculate a Bitcoin-style midstate. (That is, if SHA-256 were little-endian
     and only hashed the first block of input.)
+    
+    Full midstates from the initial state are cached; see CACHE_SIZE.
     """
     if len(data) != 64:
         raise ValueError('data must be 64 bytes long')
     
-    w = list(struct.unpack('<IIIIIIIIIIIIIIII', data))
+    cacheable = state is None and rounds is None
+    if cacheable:
+        midstate = _cache.pop(data, None)
+        if midstate is not None:
+            _cache[data] = midstate
+            return midstate
+    
+    w = expandSchedule(data)
     
     if state is not None:
         if len(state) != 32:
@@ -78,31 +111,38 @@ def calculateMidstate(data, state=None, rounds=None):
         h = H0
     
     consts = K if rounds is None else K[:rounds]
-    for k in consts:
-        s0 = rotateright(a,2) ^ rotateright(a,13) ^ rotateright(a,22)
-        s1 = rotateright(e,6) ^ rotateright(e,11) ^ rotateright(e,25)
-        ma = (a&b) ^ (a&c) ^ (b&c)
-        ch = (e&f) ^ ((~e)&g)
-        
-        h = addu32(h,w[0],k,ch,s1)
-        d = addu32(d,h)
-        h = addu32(h,ma,s0)
-        
-        a,b,c,d,e,f,g,h = h,a,b,c,d,e,f,g
-        
-        s0 = rotateright(w[1],7) ^ rotateright(w[1],18) ^ (w[1] >> 3)
-        s1 = rotateright(w[14],17) ^ rotateright(w[14],19) ^ (w[14] >> 10)
-        w.append(addu32(w[0], s0, w[9], s1))
-        w.pop(0)
-
+    for i in xrange(len(consts)):
+        t1 = (h + consts[i] + w[i] +
+              ((((e >> 6) | (e << 26)) ^ ((e >> 11) | (e << 21)) ^
+                ((e >> 25) | (e << 7))) & M32) +
+              ((e & f) ^ (~e & g)))
+        t2 = (((((a >> 2) | (a << 30)) ^ ((a >> 13) | (a << 19)) ^
+                ((a >> 22) | (a << 10))) & M32) +
+              ((a & b) ^ (a & c) ^ (b & c)))
+        h = g
+        g = f
+        f = e
+        e = (d + t1) & M32
+        d = c
+        c = b
+        b = a
+        a = (t1 + t2) & M32
+    
     if rounds is None:
-        a = addu32(a, A0)
-        b = addu32(b, B0)
-        c = addu32(c, C0)
-        d = addu32(d, D0)
-        e = addu32(e, E0)
-        f = addu32(f, F0)
-        g = addu32(g, G0)
-        h = addu32(h, H0)
+        a = (a + A0) & M32
+        b = (b + B0) & M32
+        c = (c + C0) & M32
+        d = (d + D0) & M32
+        e = (e + E0) & M32
+        f = (f + F0) & M32
+        g = (g + G0) & M32
+        h = (h + H0) & M32
+    
+    midstate = struct.pack('<IIIIIIII', a, b, c, d, e, f, g, h)
+    
+    if cacheable:
+        _cache[data] = midstate
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(False)
     
-    return struct.pack('<IIIIIIII', a, b, c, d, e, f, g, h)
\ No newline at end of file
+    return midstate
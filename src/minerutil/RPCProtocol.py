@@ -21,6 +21,7 @@
 
 import urlparse
 import json
+import time
 from twisted.internet.protocol import Protocol
 from twisted.internet import defer, task, reactor
 from twisted.web import http, client
@@ -72,6 +73,10 @@ class GetWorkProducer(object):
 
 class RPCClient(ClientBase):
     version = 'minerutil/0.5'
+    
+    # Keep-alive connection pool settings; see _getAgent.
+    poolSize = 4 # Maximum idle connections kept open to the server
+    idleTimeout = 240 # Seconds before an idle connection is closed
 
     def __init__(self, handler, hostname, port, username, password, path):
         self.handler = handler
@@ -81,12 +86,16 @@ class RPCClient(ClientBase):
             ('%s:%s' % (username, password)).encode('base64').strip()
         self.askrate = 10
         
-        self.agent = client.Agent(reactor)
+        self.agent = None
+        self.pool = None
+        self._latency = {} # Request type -> average round-trip, in seconds
         self.longPollPath = None
         self.activeLongPoll = None
         self.block = None
         self.connected = False
-        self.requesting = False
+        self.requesting = 0 # Number of getwork requests in flight
+        self.maxRequests = 1
+        self.queued = 0 # Number of getwork requests waiting to be sent
         self.active = False
         
         self.polling = task.LoopingCall(self._startRequest)
@@ -119,11 +128,25 @@ class RPCClient(ClientBase):
         if self.polling.running:
             self.polling.stop()
         self._setLongPollingPath(None)
+        self.queued = 0
+        
+        if self.pool is not None:
+            self.pool.closeCachedConnections()
+        self.agent = self.pool = None
     
-    def requestWork(self):
-        """Request work from the server immediately."""
+    def requestWork(self, count=1):
+        """Request count units of work from the server immediately. Up to
+        maxRequests getwork requests are sent in parallel; the rest are queued
+        until one of those finishes.
+        """
         
-        self._startRequest()
+        self.queued += count
+        self._startQueued()
+    
+    def _startQueued(self):
+        while self.queued and self.requesting < self.maxRequests:
+            self.queued -= 1
+            self._startRequest()
     
     def sendResult(self, result):
         """Sends a result to the server, returning a Deferred that fires with
@@ -133,7 +156,8 @@ class RPCClient(ClientBase):
         # Must be a 128-byte response, but the last 48 are typically ignored.
         result += '\x00'*48
         
-        d = self.agent.request(
+        started = time.time()
+        d = self._getAgent().request(
             'POST',
             self.baseURL + self.basePath,
             Headers(
@@ -148,9 +172,42 @@ class RPCClient(ClientBase):
             response.deliverBody(BodyLoader(d))
             return d
         d.addCallback(callback)
+        d.addCallback(lambda x: self._recordLatency('submit', started) or x)
         d.addCallback(self._processSubmissionResponse)
         return d
     
+    def getLatency(self, type='getwork'):
+        """Returns the average round-trip time of getwork (or 'submit')
+        requests, in seconds, or None if none have completed yet.
+        """
+        return self._latency.get(type)
+    
+    def _recordLatency(self, type, started):
+        latency = time.time() - started
+        if type in self._latency:
+            self._latency[type] += 0.3 * (latency - self._latency[type])
+        else:
+            self._latency[type] = latency
+    
+    def _getAgent(self):
+        """Returns the Agent used for every request to the server, creating
+        it if needed. getwork, submissions, and long-polls all share one pool
+        of keep-alive connections, so most requests skip the TCP handshake.
+        """
+        if self.agent is not None:
+            return self.agent
+        
+        # Some versions of Twisted lack connection pooling; they'll have to
+        # make do with a new connection per request.
+        if hasattr(client, 'HTTPConnectionPool'):
+            self.pool = client.HTTPConnectionPool(reactor, persistent=True)
+            self.pool.maxPersistentPerHost = self.poolSize
+            self.pool.cachedConnectionTimeout = self.idleTimeout
+            self.agent = client.Agent(reactor, pool=self.pool)
+        else:
+            self.agent = client.Agent(reactor)
+        return self.agent
+    
     def setMeta(self, var, value):
         """RPC miners do not accept meta."""
     
@@ -217,12 +274,20 @@ class RPCClient(ClientBase):
         whether a JSONRPC request is needed or not.
         """
         
-        # Only one RPC request should run at a time... Long-poll requests are
-        # limited outside of this function.
+        # Only maxRequests RPC requests should run at a time... Long-poll
+        # requests are limited outside of this function.
         if rpc:
-            if self.requesting:
+            if self.requesting >= self.maxRequests:
                 return
-            self.requesting = True
+            self.requesting += 1
+        
+        # This must only count against self.requesting once, whether it's
+        # called when the work arrives or when the request finishes.
+        done = []
+        def finished():
+            if rpc and not done:
+                done.append(True)
+                self.requesting -= 1
         
         # There are some differences between long-poll and RPC, which are
         # sorted out here.
@@ -240,7 +305,8 @@ class RPCClient(ClientBase):
             query = parsedLP.query
             url = urlparse.urlunparse((scheme, netloc, path, '', query, ''))
         
-        d = self.agent.request(
+        started = time.time()
+        d = self._getAgent().request(
             method,
             url,
             Headers(
@@ -254,7 +320,11 @@ class RPCClient(ClientBase):
         def callback(response):
             d = defer.Deferred()
             response.deliverBody(BodyLoader(d))
-            d.addCallback(lambda x: self._processResponse(x, not rpc))
+            if rpc: # A long-poll's round-trip time is meaningless.
+                d.addCallback(lambda x: self._recordLatency('getwork',
+                                                            started) or x)
+            d.addCallback(lambda x: self._processResponse(x, not rpc,
+                                                          finished))
             # Headers are not read until after the response is processed,
             # so that application callbacks are in a sensible order.
             d.addCallback(lambda x: self._readHeaders(response, rpc) or x)
@@ -263,7 +333,8 @@ class RPCClient(ClientBase):
         d.addErrback(lambda x: self._failure())
         if rpc:
             def both(ignored):
-                self.requesting = False
+                finished()
+                self._startQueued()
                 return ignored
             d.addBoth(both)
         return d
@@ -294,9 +365,10 @@ class RPCClient(ClientBase):
         
         return bool(result)
     
-    def _processResponse(self, body, push):
+    def _processResponse(self, body, push, finished):
         """Handle an unparsed JSON-RPC response, either from getwork() or
-        longpoll.
+        longpoll. finished is called to mark a getwork request as complete
+        before the work is passed on to the application.
         """
         
         result = self._parseJSONResult(body)
@@ -312,7 +384,7 @@ class RPCClient(ClientBase):
             if push:
                 self.runCallback('push', aw)
             else:
-                self.requesting = False
+                finished()
             self.runCallback('work', aw)
         except (TypeError, KeyError):
             self._failure()
@@ -321,6 +393,7 @@ class RPCClient(ClientBase):
         """Something didn't work right. Handle it and tell the application."""
         if not self.active:
             return
+        self.queued = 0 # Don't keep firing requests at a broken server.
         if msg:
             self.runCallback('msg', msg)
         if self.connected:
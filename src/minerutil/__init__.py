@@ -33,8 +33,18 @@ def openURL(url, handler):
             parsed.port or 8880, parsed.username or 'default',
             parsed.password or 'default')
         
-        for var, value in urlparse.parse_qsl(parsed.path.lstrip('/?')):
-            client.setMeta(var, value)
+        # Older urlparse leaves the query in the path for unknown schemes.
+        query = parsed.path.lstrip('/?') + '&' + parsed.query
+        for var, value in urlparse.parse_qsl(query):
+            if var == 'binary':
+                client.binary = value.lower() in ('1', 'true', 'yes', 'on')
+            elif var == 'prefetch':
+                try:
+                    client.prefetch = max(int(value), 0)
+                except ValueError:
+                    pass
+            else:
+                client.setMeta(var, value)
         
         return client
     elif parsed.scheme.lower() == 'http':
@@ -50,6 +60,21 @@ def openURL(url, handler):
                     client.askrate = float(value)
                 except ValueError:
                     pass
+            elif var == 'maxrequests':
+                try:
+                    client.maxRequests = max(int(value), 1)
+                except ValueError:
+                    pass
+            elif var == 'poolsize':
+                try:
+                    client.poolSize = max(int(value), 0)
+                except ValueError:
+                    pass
+            elif var == 'idletimeout':
+                try:
+                    client.idleTimeout = float(value)
+                except ValueError:
+                    pass
         
         return client
     else:
@@ -79,6 +79,43 @@ def populateDB(db, options):
     db.execute('INSERT INTO workerdata (worker, var, value) VALUES '
                '(?,"admin",1);', (admin,))
 
+def migrateV2(db):
+    """Schema v2: one workerdata row per (worker, var), indexed."""
+    # Older servers could leave duplicate rows behind; keep the newest.
+    db.execute('DELETE FROM workerdata WHERE rowid NOT IN (SELECT MAX(rowid) '
+               'FROM workerdata GROUP BY worker, var);')
+    db.execute('CREATE UNIQUE INDEX IF NOT EXISTS workerdata_worker_var ON '
+               'workerdata (worker, var);')
+
+# Schema migrations, in order. Migration N upgrades a database from schema
+# version N (stored in SQLite's user_version) to N+1. A freshly populated
+# database is version 1, even though its user_version reads 0.
+MIGRATIONS = [
+    None,
+    migrateV2,
+]
+
+def upgradeDB(db):
+    """Bring a database up to the current schema version, in place."""
+    version, = db.execute('PRAGMA user_version;').fetchone()
+    version = max(version, 1)
+    
+    for migration in MIGRATIONS[version:]:
+        db.execute('BEGIN;')
+        try:
+            migration(db)
+            version += 1
+            db.execute('PRAGMA user_version = %d;' % version)
+        except:
+            db.execute('ROLLBACK;')
+            raise
+        db.execute('COMMIT;')
+    
+    # Writes are single statements in autocommit mode, so with WAL each one
+    # costs one (deferred) sync instead of a rollback journal's several.
+    db.execute('PRAGMA journal_mode = WAL;')
+    db.execute('PRAGMA synchronous = NORMAL;')
+
 def main():
     options, args = parser.parse_args()
     
@@ -99,6 +136,7 @@ def main():
     db = sqlite3.connect(options._db, isolation_level=None)
     if not dbExists:
         populateDB(db, options)
+    upgradeDB(db)
     
     if options._create:
         print "Database created, launch your server with: " \
@@ -0,0 +1,76 @@
+# Copyright (C) 2011 by Sam Edwards <CFSworks@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+# If you like it, send 5.00 BTC to 1DKSjFCdUmfivJEL5Gvj41oNspNMsfgy3S :)
+
+import sqlite3
+
+from twisted.trial import unittest
+
+from multiminer import parser, populateDB, upgradeDB
+
+class UpgradeTest(unittest.TestCase):
+    def setUp(self):
+        # A version 1 file, as an older server would have left it.
+        self.path = self.mktemp()
+        self.db = sqlite3.connect(self.path, isolation_level=None)
+        options, args = parser.parse_args([])
+        populateDB(self.db, options)
+        self.db.execute('INSERT INTO workerdata (worker, var, value) VALUES '
+                        '(1,"password","old");')
+        self.db.execute('INSERT INTO workerdata (worker, var, value) VALUES '
+                        '(1,"password","new");')
+    
+    def tearDown(self):
+        self.db.close()
+    
+    def getRows(self):
+        return self.db.execute('SELECT worker, var, value FROM workerdata '
+                               'ORDER BY worker, var;').fetchall()
+    
+    def getVersion(self):
+        return self.db.execute('PRAGMA user_version;').fetchone()[0]
+    
+    def test_duplicates(self):
+        """Duplicate workerdata rows collapse to the newest one."""
+        upgradeDB(self.db)
+        self.assertEqual(self.getRows(), [(1, 'admin', '1'),
+                                          (1, 'password', 'new')])
+        self.assertRaises(sqlite3.IntegrityError, self.db.execute,
+                          'INSERT INTO workerdata (worker, var, value) VALUES '
+                          '(1,"admin",0);')
+    
+    def test_version(self):
+        """The upgraded file is stamped as schema version 2."""
+        self.assertEqual(self.getVersion(), 0)
+        upgradeDB(self.db)
+        self.db.close()
+        self.db = sqlite3.connect(self.path, isolation_level=None)
+        self.assertEqual(self.getVersion(), 2)
+    
+    def test_again(self):
+        """Upgrading an up-to-date file leaves it alone."""
+        upgradeDB(self.db)
+        rows = self.getRows()
+        changes = self.db.total_changes
+        upgradeDB(self.db)
+        self.assertEqual(self.getVersion(), 2)
+        self.assertEqual(self.getRows(), rows)
+        self.assertEqual(self.db.total_changes, changes)
@@ -0,0 +1,159 @@
+# Copyright (C) 2011 by Sam Edwards <CFSworks@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+# If you like it, send 5.00 BTC to 1DKSjFCdUmfivJEL5Gvj41oNspNMsfgy3S :)
+
+import struct
+import hashlib
+
+from twisted.trial import unittest
+from twisted.internet import defer
+
+from util import makeServer
+from WorkUnit import WorkUnit, hashResults, intToTarget
+
+class Provider(object):
+    fifo = False
+
+class VerifyTest(unittest.TestCase):
+    def setUp(self):
+        self.server = makeServer(verify_batch=1)
+        self.shares = []
+        self.solutions = []
+        self.server.workProvider.recordShare = self.shares.append
+        self.server.workProvider.sendResult = self.solutions.append
+        
+        self.result = struct.pack('<76sI', '\1'*76, 5)
+        self.hash, = hashResults([self.result])
+    
+    def verify(self, unitTarget, shareTarget=None):
+        unit = WorkUnit(Provider(), self.result, intToTarget(unitTarget), 8)
+        if shareTarget is not None:
+            shareTarget = intToTarget(shareTarget)
+        verdicts = []
+        d = self.server.verifier.verify(unit, self.result, shareTarget)
+        d.addCallback(verdicts.append)
+        return verdicts[0]
+    
+    def test_hashlib(self):
+        """hashResults is Bitcoin's double SHA-256 of the header."""
+        swapped = ''.join(self.result[i:i+4][::-1] for i in range(0, 80, 4))
+        digest = hashlib.sha256(hashlib.sha256(swapped).digest()).digest()
+        self.assertEqual(self.hash, int(digest[::-1].encode('hex'), 16))
+    
+    def test_solution(self):
+        self.assertTrue(self.verify(self.hash))
+        self.assertEqual(self.shares, [intToTarget(self.hash)])
+        self.assertEqual(self.solutions, [self.result])
+    
+    def test_share(self):
+        """A result that only meets the share target is counted, but not
+        passed on as a solution.
+        """
+        self.assertTrue(self.verify(self.hash-1, self.hash))
+        self.assertEqual(self.shares, [intToTarget(self.hash)])
+        self.assertEqual(self.solutions, [])
+    
+    def test_miss(self):
+        self.assertFalse(self.verify(self.hash-1))
+        self.assertEqual(self.shares, [])
+        self.assertEqual(self.solutions, [])
+    
+    def test_wrongUnit(self):
+        self.result = struct.pack('<76sI', '\2'*76, 5)
+        unit = WorkUnit(Provider(), '\1'*80, '\xff'*32)
+        verdicts = []
+        self.server.verifier.verify(unit, self.result).addCallback(
+            verdicts.append)
+        self.assertEqual(verdicts, [False])
+
+class OffloadTest(unittest.TestCase):
+    timeout = 30
+    
+    def setUp(self):
+        self.server = makeServer(verify_processes=1, verify_inline=4)
+        self.verifier = self.server.verifier
+        self.results = [struct.pack('<76sI', '\1'*76, nonce)
+                        for nonce in range(64)]
+    
+    def tearDown(self):
+        return self.verifier.stop()
+    
+    def test_offloaded(self):
+        """Big batches are hashed in the pool, and the verdicts come back in
+        order.
+        """
+        d = defer.gatherResults([self.verifier.hashResult(result)
+                                 for result in self.results])
+        self.assertEqual(self.verifier.getStats()['queued'], 64)
+        self.verifier.flush()
+        self.assertEqual(self.verifier.getStats()['offloaded'], 64)
+        
+        def check(hashes):
+            self.assertEqual(hashes, hashResults(self.results))
+            self.assertEqual(self.verifier.getStats()['offloaded'], 0)
+            self.assertEqual(self.verifier.batchCounts['offloaded'], 1)
+        d.addCallback(check)
+        return d
+    
+    def test_inline(self):
+        """Small batches don't bother with the pool."""
+        hashes = []
+        for result in self.results[:4]:
+            self.verifier.hashResult(result).addCallback(hashes.append)
+        self.verifier.flush()
+        self.assertEqual(hashes, hashResults(self.results[:4]))
+        self.assertEqual(self.verifier.batchCounts['offloaded'], 0)
+    
+    def test_stop(self):
+        """Stopping lets the processes answer what they have first."""
+        d = defer.gatherResults([self.verifier.hashResult(result)
+                                 for result in self.results])
+        self.verifier.flush()
+        stopped = self.verifier.stop()
+        self.assertEqual(self.verifier.getWorker(), None)
+        
+        d.addCallback(self.assertEqual, hashResults(self.results))
+        d.addCallback(lambda result: stopped)
+        d.addCallback(lambda result:
+                      self.assertEqual(self.verifier.running, set()))
+        return d
+    
+    def test_died(self):
+        """Results in a process that dies get an error, and the process is
+        replaced.
+        """
+        failures = []
+        for result in self.results:
+            d = self.verifier.hashResult(result)
+            d.addErrback(lambda failure: failures.append(failure.value))
+        self.verifier.flush()
+        worker, = self.verifier.workers
+        worker.transport.signalProcess('KILL')
+        
+        d = defer.Deferred()
+        self.verifier.stopWaiters.append(d)
+        def check(result):
+            self.assertEqual(len(failures), 64)
+            self.assertIsInstance(failures[0], RuntimeError)
+            self.assertEqual(self.verifier.getStats()['offloaded'], 0)
+            self.assertNotIdentical(self.verifier.getWorker(), worker)
+        d.addCallback(check)
+        return d
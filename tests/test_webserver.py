@@ -0,0 +1,97 @@
+# Copyright (C) 2011 by Sam Edwards <CFSworks@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+# If you like it, send 5.00 BTC to 1DKSjFCdUmfivJEL5Gvj41oNspNMsfgy3S :)
+
+import json
+import base64
+
+from twisted.trial import unittest
+from twisted.internet import reactor
+from twisted.web import server
+from twisted.web.client import getPage
+
+from util import makeServer, makeWork
+from minerutil.Midstate import calculateMidstate
+from WebServer import WebServer
+
+class BatchTest(unittest.TestCase):
+    timeout = 10
+    
+    def setUp(self):
+        self.server = makeServer()
+        self.server.web = WebServer(self.server)
+        self.port = reactor.listenTCP(0, server.Site(self.server.web),
+                                      interface='127.0.0.1')
+    
+    def tearDown(self):
+        return self.port.stopListening()
+    
+    def post(self, body):
+        url = 'http://127.0.0.1:%d/' % self.port.getHost().port
+        headers = {'Authorization': 'Basic ' +
+                   base64.b64encode('admin:admin')}
+        d = getPage(url, method='POST', postdata=json.dumps(body),
+                    headers=headers)
+        d.addCallback(json.loads)
+        return d
+    
+    def test_failingCall(self):
+        """A call that raises gets an error of its own, in its place in the
+        batch, rather than holding up the whole response.
+        """
+        def rpc_broken(account, params):
+            raise RuntimeError('broken')
+        self.server.web.rpc_broken = rpc_broken
+        
+        d = self.post([{'id': 1, 'method': 'getworkstats', 'params': []},
+                       {'id': 2, 'method': 'broken', 'params': []}])
+        def check(response):
+            self.assertEqual([r['id'] for r in response], [1, 2])
+            self.assertEqual(response[0]['error'], None)
+            self.assertEqual(response[1]['error']['code'], -32603)
+            self.assertEqual(len(self.flushLoggedErrors(RuntimeError)), 1)
+        d.addCallback(check)
+        return d
+    
+    def test_unitLimit(self):
+        """getwork_max_units applies to the batch as a whole."""
+        calls = [{'id': i, 'method': 'getwork', 'params': []}
+                 for i in range(17)]
+        d = self.post(calls)
+        d.addCallback(lambda response:
+                      self.assertEqual(response['error']['code'], -32600))
+        return d
+    
+    def test_getworks(self):
+        """getworks hands out distinct units, with their midstates."""
+        self.server.setConfig('ntime_roll', 1000)
+        self.server.workProvider.onWork(makeWork())
+        d = self.post({'id': 1, 'method': 'getworks', 'params': [3]})
+        def check(response):
+            work = response['result']
+            self.assertEqual(len(work), 3)
+            self.assertEqual(len(set(w['data'] for w in work)), 3)
+            for w in work:
+                data = w['data'].decode('hex')[:64]
+                self.assertEqual(w['midstate'].decode('hex'),
+                                 calculateMidstate(data))
+        d.addCallback(check)
+        return d
@@ -0,0 +1,59 @@
+# Copyright (C) 2011 by Sam Edwards <CFSworks@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+# If you like it, send 5.00 BTC to 1DKSjFCdUmfivJEL5Gvj41oNspNMsfgy3S :)
+
+import struct
+
+from twisted.trial import unittest
+
+from util import makeWork
+from WorkUnit import WorkUnit
+from WorkHistory import WorkHistory
+
+class Provider(object):
+    fifo = False
+
+class ClaimTest(unittest.TestCase):
+    def setUp(self):
+        aw = makeWork(mask=8)
+        self.unit = WorkUnit(Provider(), aw.data, aw.target, aw.mask)
+        self.history = WorkHistory()
+        self.history.add(self.unit)
+    
+    def result(self, nonce):
+        return self.unit.prefix + struct.pack('<I', nonce)
+    
+    def test_once(self):
+        """A result can be claimed once, and only once."""
+        self.assertEqual(self.history.claim(self.result(5)),
+                         (self.unit, self.unit.target))
+        self.assertEqual(self.history.claim(self.result(5)), (None, None))
+        self.assertEqual(self.history.claim(self.result(6)),
+                         (self.unit, self.unit.target))
+    
+    def test_readded(self):
+        """Handing the same unit out again doesn't forget its claims."""
+        self.history.claim(self.result(5))
+        self.history.add(self.unit)
+        self.assertEqual(self.history.claim(self.result(5)), (None, None))
+    
+    def test_outOfRange(self):
+        self.assertEqual(self.history.claim(self.result(256)), (None, None))
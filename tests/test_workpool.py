@@ -0,0 +1,176 @@
+# Copyright (C) 2011 by Sam Edwards <CFSworks@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+# If you like it, send 5.00 BTC to 1DKSjFCdUmfivJEL5Gvj41oNspNMsfgy3S :)
+
+import random
+import struct
+
+from twisted.trial import unittest
+
+from util import makeWork
+from WorkUnit import WorkUnit
+from WorkPool import WorkPool
+
+class Provider(object):
+    fifo = False
+
+def makeUnit(provider, timestamp=1000, mask=8, merkle='\0'):
+    aw = makeWork(timestamp=timestamp, mask=mask)
+    data = aw.data[:36] + merkle*32 + aw.data[68:]
+    return WorkUnit(provider, data, aw.target, mask)
+
+class ReferencePool(object):
+    """The pool as it was before NonceAllocator: a list of whole WorkUnits,
+    split in half as needed, with ties going to whichever went in first.
+    """
+    
+    def __init__(self):
+        self.units = [] # (seq, unit)
+        self.seq = 0
+    
+    def add(self, unit):
+        self.units.append((self.seq, unit))
+        self.seq += 1
+    
+    def rekey(self):
+        for seq, unit in self.units:
+            unit.updateSortKey()
+    
+    def _remove(self, entry):
+        self.units.remove(entry)
+        return entry[1]
+    
+    def pop(self, mask):
+        fits = [(unit.sortKey, seq) for seq, unit in self.units
+                if unit.mask >= mask]
+        if not fits:
+            return None
+        key, seq = min(fits)
+        unit = self._remove(min(entry for entry in self.units
+                                if entry[0] == seq))
+        while unit.mask > mask:
+            half = unit.mask - 1
+            self.add(unit.subrange(unit.nonce | (1<<half), half))
+            unit = unit.subrange(unit.nonce, half)
+        return unit
+    
+    def popLargest(self):
+        if not self.units:
+            return None
+        largest = max(unit.mask for seq, unit in self.units)
+        key, seq = min((unit.sortKey, seq) for seq, unit in self.units
+                       if unit.mask == largest)
+        return self._remove(min(entry for entry in self.units
+                                if entry[0] == seq))
+    
+    def getHashes(self):
+        return sum(1<<unit.mask for seq, unit in self.units)
+
+class OrderTest(unittest.TestCase):
+    def setUp(self):
+        self.provider = Provider()
+        self.pool = WorkPool()
+    
+    def test_newestFirst(self):
+        self.pool.add(makeUnit(self.provider, timestamp=1000))
+        self.pool.add(makeUnit(self.provider, timestamp=2000))
+        self.assertEqual(self.pool.pop(4).timestamp, 2000)
+    
+    def test_smallestFirst(self):
+        """Of equally new ranges, the smallest one that fits is used, so the
+        halves left over from a split are used up before anything bigger.
+        """
+        self.pool.add(makeUnit(self.provider, mask=10))
+        self.pool.add(makeUnit(self.provider, mask=8, merkle='\1'))
+        
+        first = self.pool.pop(4)
+        self.assertEqual((first.prefix[36], first.nonce, first.mask),
+                         ('\1', 0, 4))
+        second = self.pool.pop(4)
+        self.assertEqual((second.prefix[36], second.nonce), ('\1', 16))
+        self.assertEqual(self.pool.pop(5).nonce, 32)
+        
+        self.assertEqual(self.pool.hashes, (1<<10) + (1<<8) - 16 - 16 - 32)
+    
+    def test_fifo(self):
+        """Switching work_fifo on reorders the pool oldest first."""
+        self.pool.add(makeUnit(self.provider, timestamp=1000))
+        self.pool.add(makeUnit(self.provider, timestamp=2000))
+        self.provider.fifo = True
+        self.pool.rekey()
+        self.assertEqual(self.pool.pop(4).timestamp, 1000)
+    
+    def test_tooSmall(self):
+        """With nothing big enough, pop gives up and popLargest (the
+        provider's Strategy #2) takes the newest of the largest ranges.
+        """
+        self.pool.add(makeUnit(self.provider, timestamp=1000, mask=8))
+        self.pool.add(makeUnit(self.provider, timestamp=2000, mask=8))
+        self.pool.add(makeUnit(self.provider, timestamp=3000, mask=6))
+        self.assertEqual(self.pool.pop(10), None)
+        
+        unit = self.pool.popLargest()
+        self.assertEqual((unit.timestamp, unit.mask), (2000, 8))
+        self.assertEqual(len(self.pool), 2)
+        self.assertEqual(self.pool.hashes, (1<<8) + (1<<6))
+    
+    def test_empty(self):
+        self.assertEqual(self.pool.pop(0), None)
+        self.assertEqual(self.pool.popLargest(), None)
+
+class ReplayTest(unittest.TestCase):
+    def replay(self, seed, steps=300):
+        rand = random.Random(seed)
+        provider = Provider()
+        pool, reference = WorkPool(), ReferencePool()
+        
+        for step in xrange(steps):
+            action = rand.random()
+            if action < 0.15:
+                # Units are ranked by timestamp and mask, so make some ties.
+                timestamp = rand.randint(1000, 1003)
+                mask = rand.choice([12, 12, 10, 8])
+                merkle = chr(step % 256)
+                pool.add(makeUnit(provider, timestamp, mask, merkle))
+                reference.add(makeUnit(provider, timestamp, mask, merkle))
+            elif action < 0.18:
+                provider.fifo = not provider.fifo
+                pool.rekey()
+                reference.rekey()
+            else:
+                mask = rand.choice([12, 10, 9, 6, 4, 0])
+                got, expected = pool.pop(mask), reference.pop(mask)
+                if expected is None:
+                    self.assertEqual(got, None)
+                    got, expected = pool.popLargest(), reference.popLargest()
+                if expected is None:
+                    self.assertEqual(got, None)
+                else:
+                    self.assertEqual((got.data, got.mask, got.sortKey),
+                                     (expected.data, expected.mask,
+                                      expected.sortKey))
+            self.assertEqual((len(pool), pool.hashes),
+                             (len(reference.units), reference.getHashes()))
+    
+    def test_replay(self):
+        """WorkPool hands out exactly what splitting whole WorkUnits did."""
+        for seed in xrange(300):
+            self.replay(seed)
@@ -0,0 +1,122 @@
+# Copyright (C) 2011 by Sam Edwards <CFSworks@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+# If you like it, send 5.00 BTC to 1DKSjFCdUmfivJEL5Gvj41oNspNMsfgy3S :)
+
+from twisted.trial import unittest
+
+from util import makeWork
+from WorkProvider import WorkProvider
+
+class FakeServer(object):
+    web = None
+    
+    def __init__(self, **config):
+        self.config = config
+        self.workers = []
+    
+    def getConfig(self, var, type=str, default=None, callback=None):
+        return self.config.get(var, default)
+
+class ReserveTest(unittest.TestCase):
+    def test_noEstimate(self):
+        provider = WorkProvider(FakeServer(work_reserve=1234))
+        self.assertEqual(provider.getReserve(), 1234)
+    
+    def test_zeroShareRate(self):
+        """A window without any accepted results must not size the reserve
+        down to nothing.
+        """
+        provider = WorkProvider(FakeServer(work_reserve=1234))
+        provider.shares.rate = 0.0
+        self.assertEqual(provider.getReserve(), 1234)
+        
+        provider.consumed.rate = 100.0
+        self.assertEqual(provider.getHashrate(), 100.0)
+        self.assertEqual(provider.getReserve(), 1000)
+    
+    def test_latency(self):
+        provider = WorkProvider(FakeServer(work_reserve_time=10.0))
+        provider.shares.rate = 100.0
+        provider.latency.fold(2.0)
+        self.assertEqual(provider.getReserve(), 1200)
+    
+    def test_max(self):
+        """However many shares come in, the reserve stays capped."""
+        provider = WorkProvider(FakeServer(work_reserve_max=5000))
+        provider.shares.rate = 1e12
+        self.assertEqual(provider.getReserve(), 5000)
+
+class Backend(object):
+    def __init__(self):
+        self.requests = []
+    
+    def requestWork(self, count=1):
+        self.requests.append(count)
+
+class WorkRequestedTest(unittest.TestCase):
+    def setUp(self):
+        self.provider = WorkProvider(FakeServer(work_reserve=3<<32))
+        self.provider.backend = Backend()
+    
+    def test_requested(self):
+        self.provider.checkWork()
+        self.assertEqual(self.provider.workRequested, 3)
+        self.provider.onWork(makeWork('\1'*32))
+        self.assertEqual(self.provider.workRequested, 2)
+    
+    def test_pushed(self):
+        """Work pushed by the backend doesn't answer any request."""
+        self.provider.checkWork()
+        self.assertEqual(self.provider.workRequested, 3)
+        
+        work = makeWork('\1'*32)
+        self.provider.onPush(work)
+        self.provider.onWork(work)
+        # The pushed unit covers one of the three, so the rest are still
+        # outstanding and nothing more is asked for.
+        self.assertEqual(self.provider.workRequested, 3)
+        self.assertEqual(self.provider.backend.requests, [3])
+    
+    def test_burst(self):
+        """No more than work_request_max units are outstanding at once."""
+        self.provider.server.config['work_reserve'] = 100<<32
+        self.provider.server.config['work_request_max'] = 8
+        self.provider.checkWork()
+        self.assertEqual(self.provider.backend.requests, [8])
+        self.provider.onWork(makeWork('\1'*32))
+        self.assertEqual(self.provider.backend.requests, [8, 1])
+    
+    def test_unrequested(self):
+        self.provider.backend = None
+        self.provider.onWork(makeWork('\1'*32))
+        self.assertEqual(self.provider.workRequested, 0)
+
+class StatsTest(unittest.TestCase):
+    def test_backendLatency(self):
+        provider = WorkProvider(FakeServer())
+        self.assertEqual(provider.getStats()['backendLatency'], None)
+        
+        backend = Backend()
+        backend.getLatency = {'getwork': 0.5, 'submit': 0.25}.get
+        provider.backend = backend
+        stats = provider.getStats()
+        self.assertEqual(stats['backendLatency'], 0.5)
+        self.assertEqual(stats['submitLatency'], 0.25)
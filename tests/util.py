@@ -0,0 +1,68 @@
+# Copyright (C) 2011 by Sam Edwards <CFSworks@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+#
+# If you like it, send 5.00 BTC to 1DKSjFCdUmfivJEL5Gvj41oNspNMsfgy3S :)
+
+import os
+import sys
+import struct
+import sqlite3
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from twisted.test.proto_helpers import StringTransport
+
+import multiminer
+from ClusterServer import ClusterServer
+from minerutil.ClientBase import AssignedWork
+
+def makeServer(**config):
+    """Returns a ClusterServer on a fresh in-memory database, with the
+    specified config variables set.
+    """
+    options, args = multiminer.parser.parse_args([])
+    db = sqlite3.connect(':memory:', isolation_level=None)
+    multiminer.populateDB(db, options)
+    multiminer.upgradeDB(db)
+    server = ClusterServer(db)
+    for var, value in config.items():
+        server.setConfig(var, value)
+    return server
+
+def makeWork(prevHash='\1'*32, mask=32, timestamp=1000):
+    """Returns backend work, as the backend hands it to the WorkProvider."""
+    aw = AssignedWork()
+    aw.data = struct.pack('>4s32s32sI8s', '\0'*4, prevHash, '\0'*32,
+                          timestamp, '\0'*8)
+    aw.mask = mask
+    aw.target = '\xff'*32
+    return aw
+
+def connectWorker(server, username=None):
+    """Returns a WorkerConnection to the server over a StringTransport,
+    logged in as username if one is given (the password is the same).
+    """
+    connection = server.buildProtocol(None)
+    transport = StringTransport()
+    transport.sessionno = len(server.workers)
+    connection.makeConnection(transport)
+    if username is not None:
+        connection.cmd_LOGIN(username, username)
+    return connection